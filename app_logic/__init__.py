@@ -1,22 +1,101 @@
+import math
+import sqlite3
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
 from config import Config
+from app_logic.utils.startup import StartupReport
 
 db = SQLAlchemy()
 
+def _configure_sqlite(app):
+    """WAL lets readers run alongside the single writer; busy_timeout makes writers wait instead of failing."""
+    busy_timeout = app.config['SQLITE_BUSY_TIMEOUT_MS']
+
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=NORMAL')
+        cur.execute(f'PRAGMA busy_timeout={busy_timeout}')
+        cur.execute('PRAGMA temp_store=MEMORY')
+        try:
+            cur.execute('SELECT floor(1.5)')
+        except sqlite3.OperationalError:
+            # SQLite built without its math functions (heatmap binning needs floor)
+            dbapi_conn.create_function('floor', 1, math.floor, deterministic=True)
+        cur.close()
+
+    event.listen(db.engine, 'connect', on_connect)
+
+def _add_missing_columns():
+    """
+    create_all() does not alter existing tables: add nullable columns
+    introduced since, with their server default so existing rows get it too.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present and column.nullable:
+                col_type = column.type.compile(db.engine.dialect)
+                default = f' DEFAULT {column.server_default.arg}' if column.server_default is not None else ''
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}{default}'))
+
+def _create_missing_indexes():
+    """create_all() skips indexes added to tables that already exist."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def init_schema():
+    """Create missing tables, columns and indexes ('flask init-db', or at startup with AUTO_CREATE_SCHEMA)."""
+    db.create_all()
+    _add_missing_columns()
+    _create_missing_indexes()
+
 def create_app():
-    app = Flask(__name__)
-    app.config.from_object(Config)
+    report = StartupReport()
+
+    with report.phase('config'):
+        app = Flask(__name__)
+        app.config.from_object(Config)
+
+    with report.phase('database'):
+        db.init_app(app)
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                _configure_sqlite(app)
+
+    if app.config['METRICS_ENABLED']:
+        with report.phase('metrics'):
+            from app_logic.utils.metrics import init_metrics, instrument_engine
+            init_metrics(app)
+            with app.app_context():
+                instrument_engine(db.engine)
 
-    db.init_app(app)
+    with report.phase('blueprint: main'):
+        from app_logic.routes import main
+        app.register_blueprint(main)
 
-    from app_logic.routes import main
-    app.register_blueprint(main)
+    with report.phase('blueprint: admin'):
+        from app_logic.admin_routes import admin
+        app.register_blueprint(admin, url_prefix='/admin')
 
-    from app_logic.admin_routes import admin
-    app.register_blueprint(admin, url_prefix='/admin')
+    with report.phase('cli commands'):
+        from app_logic.commands import register_commands
+        register_commands(app)
 
-    with app.app_context():
-        db.create_all()
+    if app.config['AUTO_CREATE_SCHEMA']:
+        with report.phase('schema'):
+            with app.app_context():
+                init_schema()
 
+    app.extensions['startup'] = report
+    if app.config['STARTUP_REPORT']:
+        print(report.format())
     return app
@@ -1,9 +1,18 @@
+import io
 import os
-from collections import defaultdict
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
+from datetime import datetime
+from sqlalchemy import func, insert, tuple_, update
 from app_logic import db
 from app_logic.models import StopRequest, ApprovedStop
-from app_logic.utils.optimizer import optimize_route, get_existing_stops, get_full_route, cluster_requests
+from app_logic.utils.optimizer import optimize_route, rank_insertions, insert_sequentially
+from app_logic.utils.cluster_store import line_clusters, remove_requests
+from app_logic.utils.coverage import score_points
+from app_logic.utils.live_routes import get_live_route, rebuild_route, adjust_pending
+from app_logic.utils.jobs import PreviewJobs
+from app_logic.utils.ingest import CHUNK_SIZE, ingest_lines
+from app_logic.utils.metrics import span
+from app_logic.utils.reoptimize import reoptimize_line
 
 admin = Blueprint('admin', __name__)
 
@@ -14,6 +23,12 @@ def _data_dir():
 def _admin_required():
     return session.get('is_admin', False)
 
+def _preview_jobs():
+    jobs = current_app.extensions.get('preview_jobs')
+    if jobs is None:
+        jobs = current_app.extensions.setdefault('preview_jobs', PreviewJobs(current_app.config['PREVIEW_WORKERS']))
+    return jobs
+
 # ── Auth ──────────────────────────────────────────────────────────────────────
 
 @admin.route('/')
@@ -41,55 +56,148 @@ def logout():
 
 @admin.route('/dashboard')
 def dashboard():
+    """
+    Totals and per-line counts come from GROUP BY queries; the requests and
+    clusters of a line are fetched by the page only when the line is opened,
+    so rendering does not grow with the pending backlog.
+    """
     if not _admin_required():
         return redirect(url_for('admin.login'))
 
-    pending  = StopRequest.query.filter_by(status='pending').order_by(StopRequest.line_code, StopRequest.created_at).all()
-    approved = StopRequest.query.filter_by(status='approved').order_by(StopRequest.created_at.desc()).limit(20).all()
-    rejected = StopRequest.query.filter_by(status='rejected').order_by(StopRequest.created_at.desc()).limit(20).all()
-
-    # Cluster pending requests per line
-    line_clusters = defaultdict(list)
-    for r in pending:
-        line_clusters[r.line_code].append(r)
+    with span('dashboard.counts'):
+        # Submissions, not rows: a request that absorbed repeats counts each of them
+        counts = dict(db.session.query(StopRequest.status, func.sum(StopRequest.count))
+                      .group_by(StopRequest.status).all())
+        line_stats = dict(db.session.query(StopRequest.line_code, func.sum(StopRequest.count))
+                          .filter(StopRequest.status == 'pending')
+                          .group_by(StopRequest.line_code).all())
+        approved_lines = dict(db.session.query(ApprovedStop.line_code, func.count(ApprovedStop.id))
+                              .group_by(ApprovedStop.line_code).all())
+        approved = StopRequest.query.filter_by(status='approved').order_by(StopRequest.created_at.desc()).limit(20).all()
+
+    with span('template'):
+        return render_template('admin_dashboard.html',
+                               counts=counts,
+                               approved=approved,
+                               line_stats=line_stats,
+                               approved_lines=approved_lines)
+
+@admin.route('/api/clusters/<line_code>')
+def api_clusters(line_code):
+    """
+    Clusters of one line's pending requests with their insertion costs and
+    coverage scores.
+    Previews of the clusters are started in the background so opening one
+    is instant.
+    """
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
 
-    clustered = {}
-    for line, reqs in line_clusters.items():
-        clustered[line] = cluster_requests(reqs)
+    with span('clusters.load'):
+        clusters = line_clusters(line_code)
+    if not clusters:
+        return jsonify({'ok': True, 'line_code': line_code, 'clusters': []})
 
-    line_stats = {line: len(reqs) for line, reqs in line_clusters.items()}
+    data_dir = _data_dir()
+    metric = current_app.config['ROUTE_METRIC']
+    route = get_live_route(line_code, data_dir)
+    stops = route.stops
+    ranked = rank_insertions(line_code, [(c['lat'], c['lon']) for c in clusters], data_dir,
+                             metric=metric, base=stops)
+    with span('clusters.coverage'):
+        scores = score_points([c['lat'] for c in clusters], [c['lon'] for c in clusters], data_dir)
+    for c, r, sc in zip(clusters, ranked, scores):
+        c.update(r)
+        c.update(sc)
+    for c in clusters[:current_app.config['PREVIEW_PREFETCH_LIMIT']]:
+        _preview_jobs().submit(PreviewJobs.key(line_code, route.version, c['lat'], c['lon'], metric), stops, data_dir)
+
+    return jsonify({'ok': True, 'line_code': line_code, 'clusters': clusters})
+
+@admin.route('/api/pending')
+def api_pending():
+    """
+    Pending requests in (created_at, id) order, one page at a time.
+    Optional ?line_code=; pass the returned 'next' back as ?after= for the
+    following page. Keyset pagination keeps every page an index range scan.
+    """
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
 
-    return render_template('admin_dashboard.html',
-                           pending=pending,
-                           approved=approved,
-                           rejected=rejected,
-                           line_stats=line_stats,
-                           clustered=clustered)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    q = StopRequest.query.filter(StopRequest.status == 'pending')
+    line_code = request.args.get('line_code')
+    if line_code:
+        q = q.filter(StopRequest.line_code == line_code)
+    after = request.args.get('after')
+    if after:
+        try:
+            created, _, last_id = after.rpartition('_')
+            q = q.filter(tuple_(StopRequest.created_at, StopRequest.id) > (datetime.fromisoformat(created), int(last_id)))
+        except ValueError:
+            return jsonify({'ok': False, 'error': 'Cursore non valido'}), 400
+
+    rows = q.order_by(StopRequest.created_at, StopRequest.id).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = f'{page[-1].created_at.isoformat()}_{page[-1].id}' if len(rows) > limit else None
+    return jsonify({'ok': True, 'requests': [r.to_dict() for r in page], 'next': next_cursor})
 
 # ── Preview (before / after) ──────────────────────────────────────────────────
 
+def _preview_response(line_code, lat, lon):
+    """
+    Cached preview if available, otherwise start (or join) the background job
+    and wait up to PREVIEW_WAIT_MS before handing back a job id to poll.
+    """
+    data_dir = _data_dir()
+    route = get_live_route(line_code, data_dir)
+    key = PreviewJobs.key(line_code, route.version, lat, lon, current_app.config['ROUTE_METRIC'])
+    jobs = _preview_jobs()
+    result, job_id = jobs.submit(key, route.stops, data_dir)
+    if result is None:
+        with span('preview.wait'):
+            result = jobs.wait(job_id, current_app.config['PREVIEW_WAIT_MS'] / 1000)
+    if result is None and jobs.status(job_id) == 'failed':
+        return jsonify({'ok': False, 'error': 'Calcolo anteprima non riuscito'}), 500
+    if result is None:
+        return jsonify({'ok': True, 'pending': True, 'job': job_id}), 202
+    return jsonify({'ok': True, **result})
+
 @admin.route('/preview/<int:req_id>')
 def preview(req_id):
     if not _admin_required():
         return jsonify({'ok': False}), 403
 
     req = StopRequest.query.get_or_404(req_id)
-    data_dir = _data_dir()
+    return _preview_response(req.line_code, req.lat, req.lon)
 
-    # Approved stops already in DB for this line
-    existing_approved = ApprovedStop.query.filter_by(line_code=req.line_code).all()
+@admin.route('/preview-point')
+def preview_point():
+    """Preview for an arbitrary point of a line, e.g. a cluster centroid."""
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
 
-    before = get_full_route(req.line_code, data_dir, existing_approved)
-    after, insert_idx = optimize_route(req.line_code, req.lat, req.lon, data_dir, existing_approved)
+    line_code = request.args.get('line_code', '')
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if not line_code or lat is None or lon is None:
+        return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
+    return _preview_response(line_code, lat, lon)
 
-    return jsonify({
-        'ok': True,
-        'new_point': {'lat': req.lat, 'lon': req.lon},
-        'before': before,
-        'after': after,
-        'line_code': req.line_code,
-        'insert_idx': insert_idx,
-    })
+@admin.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Poll a background preview job."""
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
+
+    jobs = _preview_jobs()
+    status = jobs.status(job_id)
+    if status == 'running':
+        return jsonify({'ok': True, 'pending': True, 'job': job_id}), 202
+    result = jobs.wait(job_id, 0) if status == 'done' else None
+    if result is None:
+        return jsonify({'ok': False, 'error': f'Job {status}'}), 404
+    return jsonify({'ok': True, **result})
 
 # ── Approve ───────────────────────────────────────────────────────────────────
 
@@ -101,8 +209,9 @@ def approve(req_id):
     req = StopRequest.query.get_or_404(req_id)
     data_dir = _data_dir()
 
-    existing_approved = ApprovedStop.query.filter_by(line_code=req.line_code).all()
-    after, insert_idx = optimize_route(req.line_code, req.lat, req.lon, data_dir, existing_approved)
+    route = get_live_route(req.line_code, data_dir)
+    after, insert_idx = optimize_route(req.line_code, req.lat, req.lon, data_dir,
+                                       metric=current_app.config['ROUTE_METRIC'], base=route.stops)
 
     # Persist the approved stop
     approved_stop = ApprovedStop(
@@ -112,8 +221,12 @@ def approve(req_id):
         insert_after=insert_idx,
         request_id=req.id,
     )
+    if req.status == 'pending':
+        remove_requests([req.id])
     req.status = 'approved'
     db.session.add(approved_stop)
+    db.session.flush()
+    rebuild_route(req.line_code, data_dir)
     db.session.commit()
 
     return jsonify({'ok': True, 'optimized_route': after, 'line_code': req.line_code})
@@ -125,6 +238,9 @@ def reject(req_id):
     if not _admin_required():
         return jsonify({'ok': False}), 403
     req = StopRequest.query.get_or_404(req_id)
+    if req.status == 'pending':
+        adjust_pending(req.line_code, -(req.count or 1))
+        remove_requests([req.id])
     req.status = 'rejected'
     db.session.commit()
     return jsonify({'ok': True})
@@ -147,8 +263,9 @@ def approve_cluster():
         return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
 
     data_dir = _data_dir()
-    existing_approved = ApprovedStop.query.filter_by(line_code=line_code).all()
-    after, insert_idx = optimize_route(line_code, lat, lon, data_dir, existing_approved)
+    route = get_live_route(line_code, data_dir)
+    after, insert_idx = optimize_route(line_code, lat, lon, data_dir,
+                                       metric=current_app.config['ROUTE_METRIC'], base=route.stops)
 
     approved_stop = ApprovedStop(
         line_code=line_code,
@@ -159,9 +276,126 @@ def approve_cluster():
     db.session.add(approved_stop)
 
     # Mark all requests in cluster as approved
+    remove_requests(ids)
     StopRequest.query.filter(StopRequest.id.in_(ids)).update(
         {'status': 'approved'}, synchronize_session=False
     )
+    db.session.flush()
+    rebuild_route(line_code, data_dir)
     db.session.commit()
 
     return jsonify({'ok': True, 'optimized_route': after, 'line_code': line_code})
+
+# ── Approve many clusters (one transaction) ───────────────────────────────────
+
+@admin.route('/approve-clusters', methods=['POST'])
+def approve_clusters():
+    """
+    Approve many clusters across many lines at once.
+    Body: {"clusters": [{line_code, lat, lon, ids}, ...]}
+    Insertions are applied in order on one in-memory route per line, so later
+    clusters are placed against a route that already has the earlier ones;
+    all rows are then written with bulk statements and a single commit.
+    """
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
+
+    data = request.get_json() or {}
+    by_line = {}
+    for c in data.get('clusters', []):
+        if not c.get('ids') or c.get('lat') is None or c.get('lon') is None or not c.get('line_code'):
+            return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
+        by_line.setdefault(c['line_code'], []).append(c)
+    if not by_line:
+        return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
+
+    data_dir = _data_dir()
+    metric = current_app.config['ROUTE_METRIC']
+    stop_rows, request_ids = [], []
+    for line_code, clusters in by_line.items():
+        route = get_live_route(line_code, data_dir)
+        _, indices = insert_sequentially(route.stops, [(c['lat'], c['lon']) for c in clusters], data_dir, metric)
+        for c, idx in zip(clusters, indices):
+            stop_rows.append({'line_code': line_code, 'lat': c['lat'], 'lon': c['lon'], 'insert_after': idx})
+            request_ids.extend(c['ids'])
+
+    try:
+        # Rows are inserted in list order, so ids follow the insertion order get_full_route replays
+        db.session.execute(insert(ApprovedStop), stop_rows)
+        remove_requests(request_ids)
+        db.session.execute(
+            update(StopRequest).where(StopRequest.id.in_(request_ids)).values(status='approved')
+        )
+        routes = {line_code: rebuild_route(line_code, data_dir) for line_code in by_line}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"approve_clusters error: {e}")
+        return jsonify({'ok': False, 'error': 'Errore durante l\'approvazione'}), 500
+
+    return jsonify({
+        'ok': True,
+        'approved': len(stop_rows),
+        'routes': {
+            line_code: {'version': r.version, 'pending_count': r.pending_count, 'stops': r.stops}
+            for line_code, r in routes.items()
+        },
+    })
+
+# ── Re-optimize a line ────────────────────────────────────────────────────────
+
+@admin.route('/reoptimize/<line_code>', methods=['POST'])
+def reoptimize(line_code):
+    """
+    Re-place every approved stop of the line with 2-opt / Or-opt over the
+    whole route, within the time budget. JSON body (all optional):
+    time_budget_ms, max_iterations, fix_terminals (default true) and
+    dry_run to only report the before/after length.
+    """
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        time_budget_ms = int(data.get('time_budget_ms') or current_app.config['REOPT_TIME_BUDGET_MS'])
+        max_iterations = int(data.get('max_iterations') or current_app.config['REOPT_MAX_ITERATIONS'])
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'Parametri non validi'}), 400
+    if time_budget_ms <= 0 or max_iterations <= 0:
+        return jsonify({'ok': False, 'error': 'Parametri non validi'}), 400
+
+    data_dir = _data_dir()
+    dry_run = bool(data.get('dry_run'))
+    try:
+        report = reoptimize_line(line_code, data_dir, current_app.config['ROUTE_METRIC'],
+                                 fix_terminals=bool(data.get('fix_terminals', True)),
+                                 time_budget_s=time_budget_ms / 1000, max_iterations=max_iterations,
+                                 dry_run=dry_run)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"reoptimize error: {e}")
+        return jsonify({'ok': False, 'error': 'Errore durante la riottimizzazione'}), 500
+
+    route = get_live_route(line_code, data_dir)
+    return jsonify({'ok': True, **report, 'version': route.version, 'stops': route.stops})
+
+# ── Bulk import (NDJSON) ──────────────────────────────────────────────────────
+
+@admin.route('/import-requests', methods=['POST'])
+def import_requests():
+    """
+    Stream stop requests in as NDJSON, one /request-stop body per line.
+    The body is read line by line and inserted in chunks of ?chunk_size=
+    rows, so uploads of any size use bounded memory.
+    """
+    if not _admin_required():
+        return jsonify({'ok': False}), 403
+
+    chunk_size = request.args.get('chunk_size', CHUNK_SIZE, type=int)
+    if chunk_size < 1:
+        return jsonify({'ok': False, 'error': 'chunk_size non valido'}), 400
+
+    # The raw WSGI stream reads a line a few bytes at a time; buffer it
+    report = ingest_lines(io.BufferedReader(request.stream, 1 << 16), chunk_size=chunk_size)
+    return jsonify({'ok': report['error_count'] == 0, **report})
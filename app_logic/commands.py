@@ -0,0 +1,209 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from app_logic.utils.geodata import DATA_DIR
+from app_logic.utils.ingest import CHUNK_SIZE
+
+
+@click.command('build-stop-index')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory with the shapefiles.')
+@with_appcontext
+def build_stop_index_command(data_dir):
+    """Precompute the ordered stops of every line into data/stop_index.npz."""
+    from app_logic.utils.stop_index import build_index, write_index
+
+    t0 = time.perf_counter()
+    arrays = build_index(data_dir)
+    path = write_index(arrays, data_dir)
+    click.echo(f"Indexed {len(arrays['line_codes'])} lines, {len(arrays['lat'])} stops "
+               f"in {time.perf_counter() - t0:.2f}s → {path}")
+
+
+@click.command('build-road-graph')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory with the shapefiles.')
+@with_appcontext
+def build_road_graph_command(data_dir):
+    """Build the road graph from strade.shp into data/road_graph.npz."""
+    from app_logic.utils.road_network import build_graph, write_graph
+
+    t0 = time.perf_counter()
+    arrays = build_graph(data_dir)
+    path = write_graph(arrays, data_dir)
+    click.echo(f"Built graph with {len(arrays['node_x'])} nodes, {len(arrays['weights']) // 2} edges "
+               f"in {time.perf_counter() - t0:.2f}s → {path}")
+
+
+@click.command('build-pyramid')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory with the shapefiles.')
+@click.option('--layer', 'layers', multiple=True, help='Layer to build (repeatable). Default: roads and buildings.')
+@with_appcontext
+def build_pyramid_command(data_dir, layers):
+    """Precompute zoom-level simplifications of heavy layers into data/pyramid/."""
+    from app_logic.utils.pyramid import PYRAMID_LAYERS, PYRAMID_ZOOMS, build_pyramid, write_pyramid
+
+    for layer in layers or PYRAMID_LAYERS:
+        t0 = time.perf_counter()
+        try:
+            arrays = build_pyramid(layer, data_dir)
+        except OSError as e:
+            click.echo(f"{layer}: skipped ({e})")
+            continue
+        path = write_pyramid(layer, arrays, data_dir)
+        click.echo(f"{layer}: {len(arrays['bounds'])} features × {len(PYRAMID_ZOOMS)} levels "
+                   f"in {time.perf_counter() - t0:.2f}s → {path}")
+
+
+@click.command('import-requests')
+@click.argument('file', type=click.File('rb'))
+@click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='Rows per insert statement and transaction.')
+@with_appcontext
+def import_requests_command(file, chunk_size):
+    """Bulk-load stop requests from an NDJSON FILE ('-' for stdin)."""
+    from app_logic.utils.ingest import ingest_lines
+
+    def progress(report):
+        click.echo(f"  {report['inserted']} inserted, {report['error_count']} errors, "
+                   f"{report['rows_per_sec']:.0f} rows/s", err=True)
+
+    report = ingest_lines(file, chunk_size=chunk_size, on_chunk=progress)
+    for e in report['errors']:
+        click.echo(f"line {e['line']}: {e['error']}", err=True)
+    if report['error_count'] > len(report['errors']):
+        click.echo(f"... {report['error_count'] - len(report['errors'])} more errors", err=True)
+    click.echo(f"Imported {report['inserted']} of {report['read']} records in {report['seconds']:.2f}s "
+               f"({report['rows_per_sec']:.0f} rows/s), {report['error_count']} errors")
+
+
+@click.command('rebuild-clusters')
+@click.option('--line', 'line_code', default=None, help='Only this line. Default: every line.')
+@with_appcontext
+def rebuild_clusters_command(line_code):
+    """Recreate the persisted clusters of pending requests from scratch."""
+    from app_logic.utils.cluster_store import rebuild_clusters
+
+    t0 = time.perf_counter()
+    n = rebuild_clusters(line_code)
+    click.echo(f"Rebuilt {n} clusters in {time.perf_counter() - t0:.2f}s")
+
+
+@click.command('export-binary')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory with the shapefiles.')
+@click.option('--layer', 'layers', multiple=True, help='Layer to export (repeatable). Default: stops, lines and roads.')
+@with_appcontext
+def export_binary_command(data_dir, layers):
+    """Write layers as memory-mappable flat arrays into data/flat/."""
+    from app_logic.utils.flatgeo import FLAT_LAYERS, export_layer
+
+    for layer in layers or FLAT_LAYERS:
+        t0 = time.perf_counter()
+        try:
+            path = export_layer(layer, data_dir)
+        except OSError as e:
+            click.echo(f"{layer}: skipped ({e})")
+            continue
+        click.echo(f"{layer}: exported in {time.perf_counter() - t0:.2f}s → {path}")
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create missing tables, columns and indexes."""
+    from app_logic import init_schema
+
+    t0 = time.perf_counter()
+    init_schema()
+    click.echo(f"Schema ready in {time.perf_counter() - t0:.2f}s")
+
+
+@click.command('startup-report')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+@click.option('--no-lazy', is_flag=True, help='Skip timing the components loaded on first use.')
+def startup_report_command(as_json, no_lazy):
+    """Time create_app step by step in a fresh interpreter."""
+    import json
+
+    from app_logic.utils.startup import cold_start
+
+    report = cold_start(lazy=not no_lazy)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    for p in report['phases']:
+        click.echo(f"  {p['name']:<40} {p['ms']:8.1f} ms")
+    click.echo(f"  {'total (excluding lazy)':<40} {report['total_ms']:8.1f} ms")
+
+
+@click.command('reoptimize-routes')
+@click.option('--line', 'line_codes', multiple=True, help='Line to re-optimize (repeatable). Default: every line with approved stops.')
+@click.option('--time-budget-ms', type=int, default=None, help='Per line. Default: REOPT_TIME_BUDGET_MS.')
+@click.option('--free-terminals', is_flag=True, help='Let approved stops move before the first or after the last stop.')
+@click.option('--dry-run', is_flag=True, help='Only report the before/after lengths.')
+@with_appcontext
+def reoptimize_routes_command(line_codes, time_budget_ms, free_terminals, dry_run):
+    """Re-place approved stops with 2-opt / Or-opt over each line's whole route."""
+    from flask import current_app
+
+    from app_logic import db
+    from app_logic.models import ApprovedStop
+    from app_logic.utils.reoptimize import reoptimize_line
+
+    config = current_app.config
+    if not line_codes:
+        line_codes = [c for (c,) in db.session.query(ApprovedStop.line_code).distinct().order_by(ApprovedStop.line_code)]
+    budget_s = (time_budget_ms or config['REOPT_TIME_BUDGET_MS']) / 1000
+    for line_code in line_codes:
+        r = reoptimize_line(line_code, DATA_DIR, config['ROUTE_METRIC'], fix_terminals=not free_terminals,
+                            time_budget_s=budget_s, max_iterations=config['REOPT_MAX_ITERATIONS'], dry_run=dry_run)
+        db.session.commit()
+        if r['before_m'] is None:
+            click.echo(f"{line_code}: nothing to re-optimize")
+            continue
+        click.echo(f"{line_code}: {r['before_m']:.0f} m → {r['after_m']:.0f} m, {r['updated']}/{r['approved']} "
+                   f"approved stops moved, {r['iterations']} moves ({r['stopped']}) in {r['seconds']:.2f}s")
+
+
+@click.command('warmup')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory with the shapefiles.')
+@click.option('--lines', 'lines', default='', help='Comma separated codLinea to refresh. Default: every line.')
+@click.option('--workers', type=int, default=None, help='Worker processes. Default: one per CPU.')
+@click.option('--no-routes', is_flag=True, help='Only rebuild the stop index, not the materialized live routes.')
+@click.option('--verbose', is_flag=True, help='Print the timings of every line.')
+@with_appcontext
+def warmup_command(data_dir, lines, workers, no_routes, verbose):
+    """Precompute every line's ordered stops and live route after a deploy or data refresh."""
+    from app_logic.utils.warmup import warmup
+
+    line_codes = [c for c in lines.split(',') if c] or None
+    report = warmup(data_dir, line_codes, workers, routes=not no_routes)
+
+    timings = sorted(report['lines'].items(), key=lambda kv: -(kv[1]['order_ms'] + kv[1].get('route_ms', 0)))
+    for code, t in (timings if verbose else timings[:10]):
+        route = f", route {t['route_ms']:.1f} ms" if 'route_ms' in t else ''
+        click.echo(f"  {code:<10} {t['stops']:>4} stops, order {t['order_ms']:.1f} ms{route}")
+    if not verbose and len(timings) > 10:
+        click.echo(f"  … {len(timings) - 10} more (--verbose to list all)")
+    if report['without_stops']:
+        click.echo(f"No stops for: {', '.join(report['without_stops'])}")
+    for code, error in sorted(report['failures'].items()):
+        click.echo(f"FAILED {code}: {error}")
+    scope = 'partial' if report['partial'] else 'full'
+    index = 'written' if report['index_written'] else 'NOT written (failures)'
+    click.echo(f"Warmed {len(report['lines'])} lines ({scope}, {report['workers']} workers) in {report['seconds']:.2f}s: "
+               f"ordering {report['order_seconds']:.2f}s, routes {report['route_seconds']:.2f}s; index {index}")
+    if report['failures']:
+        raise SystemExit(1)
+
+
+def register_commands(app):
+    app.cli.add_command(build_stop_index_command)
+    app.cli.add_command(build_road_graph_command)
+    app.cli.add_command(build_pyramid_command)
+    app.cli.add_command(import_requests_command)
+    app.cli.add_command(rebuild_clusters_command)
+    app.cli.add_command(export_binary_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(startup_report_command)
+    app.cli.add_command(reoptimize_routes_command)
+    app.cli.add_command(warmup_command)
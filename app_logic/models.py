@@ -1,9 +1,14 @@
+import json
 from app_logic import db
 from datetime import datetime
 
 
 class StopRequest(db.Model):
     __tablename__ = 'stop_requests'
+    __table_args__ = (
+        # Dashboard aggregates and keyset pages of pending requests per line
+        db.Index('ix_stop_requests_status_line_created', 'status', 'line_code', 'created_at'),
+    )
 
     id         = db.Column(db.Integer, primary_key=True)
     line_code  = db.Column(db.String(20), nullable=False, index=True)
@@ -14,6 +19,9 @@ class StopRequest(db.Model):
     preferred_time = db.Column(db.String(20), nullable=True)  # e.g. "14:30"
     status         = db.Column(db.String(20), nullable=False, default='pending')  # pending | approved | rejected
     created_at     = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    cluster_id     = db.Column(db.Integer, db.ForeignKey('request_clusters.id'), nullable=True, index=True)  # pending only
+    count          = db.Column(db.Integer, nullable=True, default=1, server_default='1')  # submissions folded into this row
+    last_seen_at   = db.Column(db.DateTime, nullable=True)  # latest folded submission; None → created_at
 
     def to_dict(self):
         return {
@@ -25,6 +33,7 @@ class StopRequest(db.Model):
             'preferred_days': self.preferred_days,
             'preferred_time': self.preferred_time,
             'status': self.status,
+            'count': self.count or 1,
             'created_at': self.created_at.isoformat(),
         }
 
@@ -53,3 +62,60 @@ class ApprovedStop(db.Model):
             'insert_after': self.insert_after,
             'approved_at': self.approved_at.isoformat(),
         }
+
+
+class LineRoute(db.Model):
+    """
+    Materialized live route of a line: the ordered shapefile stops with every
+    approved stop merged in, rebuilt only when a stop on the line is approved
+    or the stop index changes. version goes up on every rebuild.
+    """
+    __tablename__ = 'line_routes'
+
+    line_code     = db.Column(db.String(20), primary_key=True)
+    version       = db.Column(db.Integer, nullable=False, default=1)
+    stops_json    = db.Column(db.Text, nullable=False)
+    source_hash   = db.Column(db.String(40), nullable=False)   # stop index hash it was built from
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at    = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def stops(self):
+        return json.loads(self.stops_json)
+
+    @property
+    def etag(self):
+        return f'{self.line_code}-{self.version}-{self.pending_count}'
+
+
+class RequestCluster(db.Model):
+    """
+    Pending requests of one line grouped around a seed point, maintained
+    incrementally as requests arrive and are decided. Members lie within
+    the clustering radius of the seed (the first member's position);
+    the centroid is sum / count. cell_x/cell_y are the seed's spatial hash
+    cell, used to find candidate clusters for a new request.
+    """
+    __tablename__ = 'request_clusters'
+    __table_args__ = (
+        db.Index('ix_request_clusters_line_cell', 'line_code', 'cell_x', 'cell_y'),
+    )
+
+    id              = db.Column(db.Integer, primary_key=True)
+    line_code       = db.Column(db.String(20), nullable=False)
+    seed_request_id = db.Column(db.Integer, nullable=False)
+    seed_lat        = db.Column(db.Float, nullable=False)
+    seed_lon        = db.Column(db.Float, nullable=False)
+    cell_x          = db.Column(db.Integer, nullable=False)
+    cell_y          = db.Column(db.Integer, nullable=False)
+    sum_lat         = db.Column(db.Float, nullable=False, default=0.0)
+    sum_lon         = db.Column(db.Float, nullable=False, default=0.0)
+    count           = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def lat(self):
+        return self.sum_lat / self.count
+
+    @property
+    def lon(self):
+        return self.sum_lon / self.count
@@ -1,67 +1,200 @@
 import os
-import geopandas as gpd
-from flask import Blueprint, render_template, request, jsonify
+import json
+import time
+import queue
+import hashlib
+import threading
+from flask import Blueprint, Response, render_template, request, jsonify, make_response, current_app, stream_with_context
+from sqlalchemy import func
 from app_logic import db
 from app_logic.models import StopRequest, ApprovedStop
-from app_logic.utils.map_utils import create_map
-from app_logic.utils.optimizer import get_full_route
+from app_logic.utils.live_routes import get_live_route
+from app_logic.utils.geodata import store
+from app_logic.utils.cache import LRUCache
+from app_logic.utils.heatmap import RAW_ZOOM, binned_pending, iter_pending_points
+from app_logic.utils.write_queue import WriteQueue
+from app_logic.utils.ingest import insert_rows, parse_record
+from app_logic.utils.dedup import RecentRequests, fold_submission
+from app_logic.utils.metrics import span
 
 main = Blueprint('main', __name__)
+_write_queue_lock = threading.Lock()
 
 def _data_dir():
     return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 
 def _get_all_lines():
-    lines_df = gpd.read_file(os.path.join(_data_dir(), 'linee_bus.shp'))
-    return sorted(lines_df['codLinea'].unique().tolist())
+    from app_logic.utils.nearest_lines import get_line_index
+    return get_line_index(_data_dir()).codes.tolist()
+
+def _write_queue():
+    wq = current_app.extensions.get('write_queue')
+    if wq is None:
+        with _write_queue_lock:
+            wq = current_app.extensions.get('write_queue')
+            if wq is None:
+                cfg = current_app.config
+                wq = current_app.extensions.setdefault('write_queue', WriteQueue(
+                    current_app._get_current_object(), cfg['INGEST_BATCH_SIZE'], cfg['INGEST_FLUSH_MS']))
+    return wq
+
+def _recent_requests():
+    if not current_app.config['DEDUP_ENABLED']:
+        return None
+    recent = current_app.extensions.get('recent_requests')
+    if recent is None:
+        cfg = current_app.config
+        recent = current_app.extensions.setdefault('recent_requests', RecentRequests(
+            cfg['DEDUP_RADIUS_M'], cfg['DEDUP_WINDOW_S']))
+    return recent
 
 # ── Citizen map ───────────────────────────────────────────────────────────────
 
+def _map_cache():
+    cache = current_app.extensions.get('map_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('map_cache', LRUCache(current_app.config['MAP_CACHE_SIZE']))
+    return cache
+
+def _map_version(enabled_layers):
+    """Everything the rendered page depends on besides the query string."""
+    files = []
+    for layer in ['lines', 'stops'] + list(enabled_layers):
+        try:
+            files.append((layer, store.signature(layer, _data_dir())))
+        except (KeyError, OSError):
+            files.append((layer, None))
+    approved = db.session.query(func.count(ApprovedStop.id), func.max(ApprovedStop.id)).one()
+    return tuple(files), tuple(approved)
+
 @main.route('/')
 def index():
     layers_param = request.args.get('layers', 'lines,stops')
-    enabled_layers = layers_param.split(',')
+    enabled_layers = sorted(set(l for l in layers_param.split(',') if l))
 
     bus_lines_param = request.args.get('bus_lines', '')
-    selected_bus_lines = bus_lines_param.split(',') if bus_lines_param else []
+    selected_bus_lines = sorted(set(l for l in bus_lines_param.split(',') if l))
+
+    tiled_layers = [l for l in enabled_layers if l in current_app.config['TILED_LAYERS']]
 
-    m = create_map(enabled_layers=enabled_layers, selected_lines=selected_bus_lines)
-    map_html = m.get_root().render()
-    all_lines = _get_all_lines()
+    key = (tuple(enabled_layers), tuple(selected_bus_lines), _map_version(enabled_layers))
+    etag = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        html = _map_cache().get(key)
+        if html is None:
+            # folium and the geodata stack load on the first uncached render only
+            from app_logic.utils.map_utils import create_map
+            with span('map.create'):
+                m = create_map(enabled_layers=enabled_layers, selected_lines=selected_bus_lines,
+                               tiled_layers=tiled_layers)
+            with span('map.folium.render'):
+                map_html = m.get_root().render()
+            all_lines = _get_all_lines()
+            with span('template'):
+                html = render_template('index.html',
+                                       map_html=map_html,
+                                       enabled_layers=enabled_layers,
+                                       tiled_layers=tiled_layers,
+                                       all_lines=all_lines,
+                                       selected_bus_lines=selected_bus_lines)
+            _map_cache().set(key, html)
+        response = make_response(html)
 
-    return render_template('index.html',
-                           map_html=map_html,
-                           enabled_layers=enabled_layers,
-                           all_lines=all_lines,
-                           selected_bus_lines=selected_bus_lines)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['MAP_CACHE_MAX_AGE']
+    return response
 
 # ── Submit stop request ───────────────────────────────────────────────────────
 
 @main.route('/request-stop', methods=['POST'])
 def request_stop():
-    data = request.get_json()
-    line_code = data.get('line_code', '').strip()
-    lat = data.get('lat')
-    lon = data.get('lon')
-    note = data.get('note', '').strip()[:300]
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('line_code') or data.get('lat') is None or data.get('lon') is None:
+        return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
 
-    preferred_days = data.get('preferred_days', '').strip()
-    preferred_time = data.get('preferred_time', '').strip()
+    # Only the citizen's fields: status and created_at are not theirs to set
+    try:
+        row = parse_record({field: data.get(field) for field in
+                            ('line_code', 'lat', 'lon', 'note', 'preferred_days', 'preferred_time')})
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
 
-    if not line_code or lat is None or lon is None:
-        return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
+    # A repeat of a recent nearby request only raises that request's count
+    recent, slot = _recent_requests(), None
+    if recent is not None:
+        req_id, slot = fold_submission(recent, row)
+        if req_id is not None:
+            db.session.commit()
+            return jsonify({'ok': True, 'id': req_id, 'merged': True})
+
+    req_id = None
+    try:
+        if current_app.config['INGEST_MODE'] == 'batched':
+            try:
+                # Returns once the batch holding the row has committed
+                req_id = _write_queue().submit(row)
+            except (queue.Full, TimeoutError):
+                return jsonify({'ok': False, 'error': 'Servizio occupato, riprova'}), 503
+            except Exception:
+                return jsonify({'ok': False, 'error': 'Errore durante il salvataggio'}), 500
+        else:
+            req_id = insert_rows([row])[0]
+            db.session.commit()
+    finally:
+        # Repeats waiting on this submission fold into the new row (or retry if it failed)
+        if slot is not None:
+            recent.fill(slot, req_id)
+    return jsonify({'ok': True, 'id': req_id})
+
+# ── Nearest lines ─────────────────────────────────────────────────────────────
 
-    stop_req = StopRequest(
-        line_code=line_code,
-        lat=lat,
-        lon=lon,
-        note=note,
-        preferred_days=preferred_days,
-        preferred_time=preferred_time
-    )
-    db.session.add(stop_req)
-    db.session.commit()
-    return jsonify({'ok': True, 'id': stop_req.id})
+NEAREST_LINES_MAX_POINTS = 10000
+
+def _nearest_json(matches):
+    return [{'line_code': code, 'distance_m': round(d, 1)} for code, d in matches]
+
+@main.route('/api/nearest-lines', methods=['GET', 'POST'])
+def api_nearest_lines():
+    """
+    The ?k= lines closest to ?lat=&lon=, nearest first, with distances in
+    metres. POST {"points": [[lat, lon], ...], "k": 5} checks many points
+    in one call and returns one list per point.
+    """
+    from app_logic.utils.nearest_lines import get_line_index
+
+    t0 = time.perf_counter()
+    index = get_line_index(_data_dir())
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        points = data.get('points')
+        try:
+            k = int(data.get('k', 5))
+            lat, lon = zip(*[(float(p[0]), float(p[1])) for p in points]) if points else ((), ())
+        except (TypeError, ValueError, IndexError):
+            return jsonify({'ok': False, 'error': 'points deve essere [[lat, lon], ...]'}), 400
+        if len(lat) > NEAREST_LINES_MAX_POINTS:
+            return jsonify({'ok': False, 'error': f'Massimo {NEAREST_LINES_MAX_POINTS} punti'}), 400
+        results = index.nearest(lat, lon, k) if lat else []
+        return jsonify({
+            'ok': True,
+            'results': [_nearest_json(m) for m in results],
+            'took_ms': round((time.perf_counter() - t0) * 1000, 2),
+        })
+
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    k = request.args.get('k', 5, type=int)
+    if lat is None or lon is None:
+        return jsonify({'ok': False, 'error': 'Dati mancanti'}), 400
+    return jsonify({
+        'ok': True,
+        'lines': _nearest_json(index.nearest(lat, lon, k)[0]),
+        'took_ms': round((time.perf_counter() - t0) * 1000, 2),
+    })
 
 # ── Public live route API ──────────────────────────────────────────────────────
 
@@ -70,19 +203,22 @@ def api_route(line_code):
     """
     Return the live route for a bus line, merging shapefile stops with
     any approved stops from the DB. Used by the citizen map to update
-    dynamically after admin approvals.
+    dynamically after admin approvals. Served from the materialized
+    LineRoute row; clients can revalidate with If-None-Match.
     """
-    data_dir = _data_dir()
-    approved = ApprovedStop.query.filter_by(line_code=line_code).all()
-    route = get_full_route(line_code, data_dir, approved)
-    # Also include pending cluster count for the line
-    pending_count = StopRequest.query.filter_by(line_code=line_code, status='pending').count()
-    return jsonify({
-        'ok': True,
-        'line_code': line_code,
-        'stops': route,
-        'pending_count': pending_count,
-    })
+    route = get_live_route(line_code, _data_dir())
+    if route.version == 0:
+        return jsonify({'ok': False, 'error': 'Linea non trovata'}), 404
+    if request.if_none_match.contains(route.etag):
+        response = make_response('', 304)
+    else:
+        body = ('{"ok":true,"line_code":%s,"version":%d,"pending_count":%d,"stops":%s}'
+                % (json.dumps(route.line_code), route.version, route.pending_count, route.stops_json))
+        response = make_response(body)
+        response.mimetype = 'application/json'
+    response.set_etag(route.etag)
+    response.cache_control.no_cache = True
+    return response
 
 # ── Pending heatmap data ───────────────────────────────────────────────────────
 
@@ -92,5 +228,62 @@ def api_pending_points():
     pending = StopRequest.query.filter_by(status='pending').all()
     return jsonify({
         'ok': True,
-        'points': [{'lat': r.lat, 'lon': r.lon, 'line': r.line_code} for r in pending],
+        'points': [{'lat': r.lat, 'lon': r.lon, 'line': r.line_code, 'count': r.count or 1} for r in pending],
     })
+
+@main.route('/api/pending-heatmap')
+def api_pending_heatmap():
+    """
+    Pending requests inside ?bbox=w,s,e,n for the map at ?zoom=, optionally
+    for ?line=a,b. Below RAW_ZOOM they come back as grid cells with counts;
+    from RAW_ZOOM up the individual points are streamed.
+    """
+    try:
+        bbox = [float(v) for v in request.args.get('bbox', '').split(',')]
+        zoom = int(request.args.get('zoom', 13))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'Parametri non validi'}), 400
+    if len(bbox) != 4:
+        return jsonify({'ok': False, 'error': 'bbox deve essere w,s,e,n'}), 400
+    lines = [l for l in request.args.get('line', '').split(',') if l]
+
+    if zoom < RAW_ZOOM:
+        return jsonify({'ok': True, **binned_pending(bbox, zoom, lines)})
+
+    def generate():
+        yield '{"ok":true,"mode":"points","points":['
+        sep = ''
+        batch = []
+        for lat, lon, line, count in iter_pending_points(bbox, lines):
+            batch.append(json.dumps({'lat': lat, 'lon': lon, 'line': line, 'count': count or 1}))
+            if len(batch) == 500:
+                yield sep + ','.join(batch)
+                sep, batch = ',', []
+        if batch:
+            yield sep + ','.join(batch)
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# ── Map layer tiles ───────────────────────────────────────────────────────────
+
+@main.route('/api/tiles/<layer>/<int:z>/<int:x>/<int:y>')
+def api_tiles(layer, z, x, y):
+    """GeoJSON features of a map layer inside one XYZ tile, simplified for its zoom."""
+    from app_logic.utils.tiles import render_tile
+
+    bus_lines_param = request.args.get('bus_lines', '')
+    selected_bus_lines = [l for l in bus_lines_param.split(',') if l]
+    try:
+        body = render_tile(layer, z, x, y, _data_dir(), selected_bus_lines)
+    except (KeyError, OSError):
+        return jsonify({'ok': False, 'error': 'Livello non disponibile'}), 404
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+
+    response = make_response(body)
+    response.mimetype = 'application/geo+json'
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['MAP_CACHE_MAX_AGE']
+    return response.make_conditional(request)
@@ -0,0 +1,212 @@
+import math
+from collections import defaultdict
+
+from sqlalchemy import bindparam, delete, update
+
+from app_logic import db
+from app_logic.models import RequestCluster, StopRequest
+from app_logic.utils.clustering import DEFAULT_RADIUS_M
+from app_logic.utils.geo import to_local_xy
+
+
+RADIUS_M = DEFAULT_RADIUS_M
+
+# Increment a cluster's sums in SQL so concurrent writers do not lose updates
+_increment = (
+    update(RequestCluster.__table__)
+    .where(RequestCluster.__table__.c.id == bindparam('cid'))
+    .values(sum_lat=RequestCluster.__table__.c.sum_lat + bindparam('dlat'),
+            sum_lon=RequestCluster.__table__.c.sum_lon + bindparam('dlon'),
+            count=RequestCluster.__table__.c.count + bindparam('dcount'))
+)
+
+
+def _cell(x: float, y: float) -> tuple:
+    return math.floor(x / RADIUS_M), math.floor(y / RADIUS_M)
+
+
+# ── Assign ────────────────────────────────────────────────────────────────────
+
+def assign_requests(rows):
+    """
+    Put new pending requests into clusters. rows: (id, line_code, lat, lon)
+    or (id, line_code, lat, lon, count) in arrival order; a request counts
+    for its count submissions (1 when missing) in the cluster's sums. Each
+    request joins the cluster with the nearest seed within RADIUS_M, found
+    through the seed's spatial hash cell and its eight neighbours, or seeds
+    a new cluster. Does not commit.
+    """
+    by_line = defaultdict(list)
+    for row in rows:
+        by_line[row[1]].append(row)
+
+    links, deltas = [], defaultdict(lambda: [0.0, 0.0, 0])
+    for line_code, members in by_line.items():
+        x, y = to_local_xy([m[2] for m in members], [m[3] for m in members])
+        cells = [_cell(px, py) for px, py in zip(x, y)]
+        xs, ys = [c[0] for c in cells], [c[1] for c in cells]
+
+        grid = defaultdict(list)   # cell → [[cluster id or new RequestCluster, seed x, seed y]]
+        candidates = (db.session.query(RequestCluster.id, RequestCluster.seed_lat, RequestCluster.seed_lon,
+                                       RequestCluster.cell_x, RequestCluster.cell_y)
+                      .filter(RequestCluster.line_code == line_code,
+                              RequestCluster.cell_x.between(min(xs) - 1, max(xs) + 1),
+                              RequestCluster.cell_y.between(min(ys) - 1, max(ys) + 1))
+                      .all())
+        for cid, seed_lat, seed_lon, cx, cy in candidates:
+            sx, sy = to_local_xy(seed_lat, seed_lon)
+            grid[(cx, cy)].append([cid, float(sx), float(sy)])
+
+        for (rid, _, lat, lon, *weight), px, py, (cx, cy) in zip(members, x, y, cells):
+            w = (weight[0] if weight else None) or 1
+            best, best_d = None, math.inf
+            for gx in (cx - 1, cx, cx + 1):
+                for gy in (cy - 1, cy, cy + 1):
+                    for entry in grid.get((gx, gy), ()):
+                        d = math.hypot(px - entry[1], py - entry[2])
+                        if d <= RADIUS_M and d < best_d:
+                            best, best_d = entry, d
+            if best is None:
+                cluster = RequestCluster(line_code=line_code, seed_request_id=rid, seed_lat=lat, seed_lon=lon,
+                                         cell_x=cx, cell_y=cy, sum_lat=0.0, sum_lon=0.0, count=0)
+                db.session.add(cluster)
+                best = [cluster, float(px), float(py)]
+                grid[(cx, cy)].append(best)
+            target = best[0]
+            if isinstance(target, RequestCluster):
+                target.sum_lat += w * lat
+                target.sum_lon += w * lon
+                target.count += w
+            else:
+                d = deltas[target]
+                d[0] += w * lat
+                d[1] += w * lon
+                d[2] += w
+            links.append((rid, target))
+
+    if not links:
+        return
+    db.session.flush()   # ids for the new clusters
+    if deltas:
+        db.session.execute(_increment, [{'cid': cid, 'dlat': d[0], 'dlon': d[1], 'dcount': d[2]}
+                                        for cid, d in deltas.items()])
+    db.session.execute(update(StopRequest), [
+        {'id': rid, 'cluster_id': t.id if isinstance(t, RequestCluster) else t} for rid, t in links
+    ])
+
+
+# ── Remove ────────────────────────────────────────────────────────────────────
+
+def remove_requests(ids):
+    """
+    Take requests that are being approved or rejected out of their clusters.
+    Sums and counts shrink in place; empty clusters are deleted. A cluster
+    that lost its seed is dissolved and its remaining members are assigned
+    again, which may split it. Does not commit.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    members = (db.session.query(StopRequest.cluster_id, StopRequest.lat, StopRequest.lon, StopRequest.count)
+               .filter(StopRequest.id.in_(ids), StopRequest.cluster_id.isnot(None))
+               .all())
+    if not members:
+        return
+
+    deltas = defaultdict(lambda: [0.0, 0.0, 0])
+    for cid, lat, lon, count in members:
+        w = count or 1
+        d = deltas[cid]
+        d[0] -= w * lat
+        d[1] -= w * lon
+        d[2] -= w
+    db.session.execute(update(StopRequest).where(StopRequest.id.in_(ids)).values(cluster_id=None))
+    db.session.execute(_increment, [{'cid': cid, 'dlat': d[0], 'dlon': d[1], 'dcount': d[2]}
+                                    for cid, d in deltas.items()])
+
+    touched = list(deltas)
+    db.session.execute(delete(RequestCluster).where(RequestCluster.id.in_(touched), RequestCluster.count <= 0))
+    orphaned = [cid for (cid,) in db.session.query(RequestCluster.id)
+                .filter(RequestCluster.id.in_(touched), RequestCluster.seed_request_id.in_(ids))]
+    if orphaned:
+        _dissolve(orphaned)
+
+
+def add_submissions(cluster_id: int, lat: float, lon: float, n: int = 1):
+    """A member request at (lat, lon) absorbed n more submissions: weigh it n more times. Does not commit."""
+    db.session.execute(_increment, [{'cid': cluster_id, 'dlat': n * lat, 'dlon': n * lon, 'dcount': n}])
+
+
+def _dissolve(cluster_ids):
+    rows = (db.session.query(StopRequest.id, StopRequest.line_code, StopRequest.lat, StopRequest.lon,
+                             StopRequest.count)
+            .filter(StopRequest.cluster_id.in_(cluster_ids))
+            .order_by(StopRequest.created_at, StopRequest.id)
+            .all())
+    db.session.execute(update(StopRequest).where(StopRequest.cluster_id.in_(cluster_ids)).values(cluster_id=None))
+    db.session.execute(delete(RequestCluster).where(RequestCluster.id.in_(cluster_ids)))
+    assign_requests(rows)
+
+
+# ── Read / rebuild ────────────────────────────────────────────────────────────
+
+def _unassigned(line_code=None):
+    q = (db.session.query(StopRequest.id, StopRequest.line_code, StopRequest.lat, StopRequest.lon,
+                          StopRequest.count)
+         .filter(StopRequest.status == 'pending', StopRequest.cluster_id.is_(None)))
+    if line_code is not None:
+        q = q.filter(StopRequest.line_code == line_code)
+    return q.order_by(StopRequest.created_at, StopRequest.id).all()
+
+
+def line_clusters(line_code: str) -> list:
+    """
+    Persisted clusters of a line in seed order, in the shape of
+    clustering.cluster_requests plus the cluster id. Pending requests that
+    predate cluster maintenance are assigned (and committed) first.
+    """
+    unassigned = _unassigned(line_code)
+    if unassigned:
+        assign_requests(unassigned)
+        db.session.commit()
+
+    clusters = {
+        c.id: {
+            'id': c.id,
+            'lat': c.lat,
+            'lon': c.lon,
+            'count': c.count,
+            'line_code': line_code,
+            'request_ids': [],
+            'notes': [],
+        }
+        for c in RequestCluster.query.filter_by(line_code=line_code).order_by(RequestCluster.id)
+    }
+    members = (db.session.query(StopRequest.id, StopRequest.cluster_id, StopRequest.note)
+               .filter(StopRequest.status == 'pending', StopRequest.line_code == line_code)
+               .order_by(StopRequest.created_at, StopRequest.id))
+    for rid, cid, note in members:
+        c = clusters.get(cid)
+        if c is None:
+            continue
+        c['request_ids'].append(rid)
+        if note:
+            c['notes'].append(note)
+    return list(clusters.values())
+
+
+def rebuild_clusters(line_code=None) -> int:
+    """Recreate clusters from scratch for one line or all of them. Returns the number of clusters. Commits."""
+    requests = update(StopRequest).values(cluster_id=None)
+    clusters = delete(RequestCluster)
+    if line_code is not None:
+        requests = requests.where(StopRequest.line_code == line_code)
+        clusters = clusters.where(RequestCluster.line_code == line_code)
+    db.session.execute(requests)
+    db.session.execute(clusters)
+    assign_requests(_unassigned(line_code))
+    db.session.commit()
+    q = RequestCluster.query
+    if line_code is not None:
+        q = q.filter_by(line_code=line_code)
+    return q.count()
@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+import numpy as np
+
+from app_logic.utils.geo import to_local_xy
+
+
+DEFAULT_RADIUS_M = 300.0
+
+# Groups (lines) are shifted this far apart on the x axis so a single
+# KD-tree can cluster every line at once without mixing them.
+_GROUP_OFFSET_M = 1e8
+
+
+# ── Engine ────────────────────────────────────────────────────────────────────
+
+def cluster_labels(lat, lon, groups=None, radius_m: float = DEFAULT_RADIUS_M) -> np.ndarray:
+    """
+    Greedy radius clustering over a KD-tree.
+    Points are visited in input order; each unvisited point becomes a seed
+    and absorbs every unvisited point of the same group within radius_m.
+    Returns one cluster label per point, numbered in seed order.
+    """
+    from scipy.spatial import cKDTree
+
+    x, y = to_local_xy(lat, lon)
+    n = len(x)
+    labels = np.full(n, -1, dtype=np.intp)
+    if n == 0:
+        return labels
+
+    if groups is not None:
+        _, group_ids = np.unique(np.asarray(groups, dtype=str), return_inverse=True)
+        x = x + group_ids * _GROUP_OFFSET_M
+    xy = np.column_stack([x, y])
+    tree = cKDTree(xy)
+
+    next_label = 0
+    for i in range(n):
+        if labels[i] >= 0:
+            continue
+        nb = np.asarray(tree.query_ball_point(xy[i], radius_m), dtype=np.intp)
+        nb = nb[labels[nb] < 0]
+        labels[nb] = next_label
+        next_label += 1
+    return labels
+
+
+def _build_clusters(requests, labels) -> list:
+    lat = np.array([r.lat for r in requests], dtype=float)
+    lon = np.array([r.lon for r in requests], dtype=float)
+    # Requests that absorbed repeat submissions weigh as many times
+    weight = np.array([getattr(r, 'count', None) or 1 for r in requests], dtype=float)
+    n_clusters = int(labels.max()) + 1 if len(labels) else 0
+    counts = np.bincount(labels, weights=weight, minlength=n_clusters)
+    c_lat = np.bincount(labels, weights=weight * lat, minlength=n_clusters) / np.maximum(counts, 1)
+    c_lon = np.bincount(labels, weights=weight * lon, minlength=n_clusters) / np.maximum(counts, 1)
+
+    clusters = [
+        {
+            'lat': float(c_lat[k]),
+            'lon': float(c_lon[k]),
+            'count': int(counts[k]),
+            'line_code': None,
+            'request_ids': [],
+            'notes': [],
+        }
+        for k in range(n_clusters)
+    ]
+    for r, k in zip(requests, labels):
+        c = clusters[k]
+        if c['line_code'] is None:
+            c['line_code'] = r.line_code
+        c['request_ids'].append(r.id)
+        if r.note:
+            c['notes'].append(r.note)
+    return clusters
+
+
+# ── Request clustering ────────────────────────────────────────────────────────
+
+def cluster_requests(requests, radius_m: float = DEFAULT_RADIUS_M) -> list:
+    """
+    Group nearby requests of the same line (within radius_m metres) into a
+    single representative point.
+    Returns a list of cluster dicts:
+      { lat, lon, count, line_code, request_ids, notes }
+    """
+    requests = list(requests)
+    labels = cluster_labels([r.lat for r in requests], [r.lon for r in requests],
+                            [r.line_code for r in requests], radius_m)
+    return _build_clusters(requests, labels)
+
+
+def cluster_requests_by_line(requests, radius_m: float = DEFAULT_RADIUS_M) -> dict:
+    """Cluster requests of every line in one pass. Returns {line_code: [cluster, ...]}."""
+    by_line = defaultdict(list)
+    for c in cluster_requests(requests, radius_m):
+        by_line[c['line_code']].append(c)
+    return dict(by_line)
@@ -0,0 +1,104 @@
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from app_logic.utils.flatgeo import get_flat
+from app_logic.utils.geo import to_local_xy
+from app_logic.utils.geodata import DATA_DIR, get_layer, store
+
+
+WALK_RADIUS_M = 400.0   # a building is served when a stop is this close to its centroid
+
+
+def _layer_xy(layer: str, data_dir: str):
+    flat = get_flat(layer, data_dir) if layer == 'stops' else None
+    if flat is not None:
+        lon, lat = flat.coords[:, 0], flat.coords[:, 1]
+    else:
+        gdf = get_layer(layer, data_dir)
+        pts = shapely.centroid(gdf.geometry.values) if layer == 'buildings' else gdf.geometry.values
+        lon, lat = shapely.get_x(pts), shapely.get_y(pts)
+    x, y = to_local_xy(lat, lon)
+    xy = np.column_stack([x, y])
+    return xy[np.isfinite(xy).all(axis=1)]
+
+
+class Coverage:
+    """
+    Walking catchment of the existing fermate_bus stops.
+    Buildings already within WALK_RADIUS_M of a stop are worked out once;
+    only the uncovered ones go into a KD-tree, so the buildings a new stop
+    would add are a single radius count against it. buildings is None when
+    edifici.shp is not available.
+    """
+
+    def __init__(self, stops_xy, buildings_xy, signature, radius_m: float = WALK_RADIUS_M):
+        from scipy.spatial import cKDTree
+
+        self.signature = signature
+        self.radius_m = radius_m
+        self._stops = cKDTree(stops_xy)
+        self.buildings = None if buildings_xy is None else len(buildings_xy)
+        self.covered = None
+        self._uncovered = None
+        if buildings_xy is not None:
+            d, _ = self._stops.query(buildings_xy, distance_upper_bound=radius_m)
+            covered = np.isfinite(d)
+            self.covered = int(covered.sum())
+            self._uncovered = cKDTree(buildings_xy[~covered])
+
+    def score(self, lat, lon) -> list:
+        """
+        For each point: distance to the nearest existing stop and the number
+        of buildings it would bring within walking distance (None without
+        buildings data). Returns [{nearest_stop_m, new_buildings}, ...].
+        """
+        x, y = to_local_xy(np.atleast_1d(lat), np.atleast_1d(lon))
+        xy = np.column_stack([x, y])
+        nearest, _ = self._stops.query(xy)
+        if self._uncovered is not None:
+            new = self._uncovered.query_ball_point(xy, self.radius_m, return_length=True)
+        else:
+            new = [None] * len(xy)
+        return [
+            {'nearest_stop_m': round(float(d), 1), 'new_buildings': None if n is None else int(n)}
+            for d, n in zip(nearest, new)
+        ]
+
+    def stats(self) -> dict:
+        return {'radius_m': self.radius_m, 'stops': self._stops.n,
+                'buildings': self.buildings, 'covered_buildings': self.covered}
+
+
+_coverages = {}   # data_dir → Coverage
+_lock = threading.Lock()
+
+
+def _signature(data_dir: str) -> tuple:
+    try:
+        buildings = store.signature('buildings', data_dir)
+    except OSError:
+        buildings = None
+    return store.signature('stops', data_dir), buildings
+
+
+def get_coverage(data_dir: str = DATA_DIR) -> Coverage:
+    """Coverage for data_dir, built once per process and again when the stops or buildings change."""
+    key = os.path.abspath(data_dir)
+    signature = _signature(data_dir)
+    coverage = _coverages.get(key)
+    if coverage is not None and coverage.signature == signature:
+        return coverage
+    with _lock:
+        coverage = _coverages.get(key)
+        if coverage is None or coverage.signature != signature:
+            buildings_xy = _layer_xy('buildings', data_dir) if signature[1] is not None else None
+            coverage = Coverage(_layer_xy('stops', data_dir), buildings_xy, signature)
+            _coverages[key] = coverage
+        return coverage
+
+
+def score_points(lat, lon, data_dir: str = DATA_DIR) -> list:
+    return get_coverage(data_dir).score(lat, lon)
@@ -0,0 +1,201 @@
+import math
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from app_logic import db
+from app_logic.models import StopRequest
+from app_logic.utils.cluster_store import add_submissions
+from app_logic.utils.geo import to_local_xy
+from app_logic.utils.live_routes import adjust_pending
+
+
+NOTE_SEPARATOR = ' | '
+PRUNE_EVERY = 1000            # grid updates between sweeps of expired entries
+RESERVATION_TIMEOUT_S = 5.0   # how long a repeat waits on each look at a pending insert
+
+
+def merge_notes(existing: str, new: str, limit: int = 300) -> str:
+    """Append a note that is not already there, keeping the column limit."""
+    existing, new = (existing or '').strip(), (new or '').strip()
+    if not new or new in existing.split(NOTE_SEPARATOR):
+        return existing
+    return (existing + NOTE_SEPARATOR + new if existing else new)[:limit]
+
+
+def merge_days(existing: str, new: str, limit: int = 100) -> str:
+    """Union of two comma-separated day lists, in first-seen order."""
+    days = []
+    for d in (existing or '').split(',') + (new or '').split(','):
+        d = d.strip()
+        if d and d not in days:
+            days.append(d)
+    return ','.join(days)[:limit]
+
+
+class RecentRequests:
+    """
+    Per-line spatial hash of the pending requests submitted in the last
+    window_s seconds, so a repeat submission (a double click on "Invia",
+    the same citizen twice) can be folded into the row it repeats instead
+    of becoming a new one. Cells are radius_m wide, so a match is always in
+    the submission's cell or one of its eight neighbours.
+
+    A submission with no match reserves its place in the grid until its row
+    is inserted; a repeat arriving meanwhile waits for the id and folds into
+    it, so two simultaneous clicks still make one row.
+
+    A line is loaded from the database on first use and kept up to date
+    with this process's own submissions. Other workers' submissions after
+    that are not seen, so a repeat may still create a row: dedup only
+    compacts the table, it never loses a submission.
+    """
+
+    def __init__(self, radius_m: float = 10.0, window_s: float = 600.0):
+        self.radius_m = radius_m
+        self.window = timedelta(seconds=window_s)
+        self._lines = {}   # line_code → {cell: [[id, x, y, last_seen, reserved]]}
+        self._lock = threading.Lock()
+        self._since_prune = 0
+
+    def _cell(self, x: float, y: float) -> tuple:
+        return math.floor(x / self.radius_m), math.floor(y / self.radius_m)
+
+    def _grid(self, line_code: str, now: datetime) -> dict:
+        grid = self._lines.get(line_code)
+        if grid is not None:
+            return grid
+        last_seen = func.coalesce(StopRequest.last_seen_at, StopRequest.created_at)
+        rows = (db.session.query(StopRequest.id, StopRequest.lat, StopRequest.lon, last_seen)
+                .filter(StopRequest.status == 'pending', StopRequest.line_code == line_code,
+                        last_seen >= now - self.window)
+                .all())
+        grid = defaultdict(list)
+        if rows:
+            x, y = to_local_xy([r[1] for r in rows], [r[2] for r in rows])
+            for (rid, _, _, seen), px, py in zip(rows, x, y):
+                grid[self._cell(px, py)].append([rid, float(px), float(py), seen, None])
+        self._lines[line_code] = grid
+        return grid
+
+    def _nearest(self, grid: dict, px: float, py: float, now: datetime):
+        cx, cy = self._cell(px, py)
+        oldest = now - self.window
+        best, best_d = None, math.inf
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                entries = grid.get((gx, gy))
+                if not entries:
+                    continue
+                entries[:] = [e for e in entries if e[3] >= oldest]
+                for e in entries:
+                    d = math.hypot(px - e[1], py - e[2])
+                    if d <= self.radius_m and d < best_d:
+                        best, best_d = e, d
+        return best
+
+    def claim(self, line_code: str, lat: float, lon: float, now: datetime) -> tuple:
+        """
+        (id, None) for the nearest recent request within radius_m, or
+        (None, slot) with a reservation the caller must pass to fill() once
+        its row is inserted (or has failed). Waits while the nearest match is
+        another caller's reservation. Drops expired entries it passes.
+        """
+        px, py = (float(v) for v in to_local_xy(lat, lon))
+        while True:
+            with self._lock:
+                grid = self._grid(line_code, now)
+                best = self._nearest(grid, px, py, now)
+                if best is None:
+                    slot = [None, px, py, now, threading.Event()]
+                    grid[self._cell(px, py)].append(slot)
+                    return None, slot
+                if best[4] is None:
+                    return best[0], None
+                reserved = best[4]
+            reserved.wait(RESERVATION_TIMEOUT_S)
+
+    def fill(self, slot: list, request_id):
+        """Complete a reservation with the inserted id, or drop it when request_id is None."""
+        with self._lock:
+            if request_id is None:
+                slot[3] = datetime.min   # expired: the next pass over its cell removes it
+            else:
+                slot[0] = request_id
+            reserved, slot[4] = slot[4], None
+            self._count_update(slot[3])
+        reserved.set()
+
+    def remember(self, request_id: int, line_code: str, lat: float, lon: float, now: datetime):
+        """Refresh the time of a request that absorbed a submission, adding it if unknown."""
+        px, py = (float(v) for v in to_local_xy(lat, lon))
+        with self._lock:
+            entries = self._grid(line_code, now)[self._cell(px, py)]
+            for e in entries:
+                if e[0] == request_id:
+                    e[3] = now
+                    break
+            else:
+                entries.append([request_id, px, py, now, None])
+            self._count_update(now)
+
+    def forget(self, line_code: str, request_id: int):
+        with self._lock:
+            for entries in self._lines.get(line_code, {}).values():
+                entries[:] = [e for e in entries if e[0] != request_id]
+
+    def _count_update(self, now: datetime):
+        self._since_prune += 1
+        if self._since_prune >= PRUNE_EVERY:
+            self._prune(now)
+
+    def _prune(self, now: datetime):
+        oldest = now - self.window
+        for grid in self._lines.values():
+            for cell in [c for c, entries in grid.items() if not any(e[3] >= oldest for e in entries)]:
+                del grid[cell]
+        self._since_prune = 0
+
+
+def fold_submission(recent: RecentRequests, row: dict) -> tuple:
+    """
+    Fold a validated /request-stop row into a recent pending request close
+    enough to it: the count goes up, notes and preferred days are merged,
+    and the line's pending count and the request's cluster grow by one
+    submission. Returns (id it was folded into, None), or (None, slot) when
+    the row has to be inserted: pass the slot to recent.fill() with the new
+    id, or None if the insert failed. Does not commit.
+    """
+    line_code, now = row['line_code'], row['created_at']
+    while True:
+        rid, slot = recent.claim(line_code, row['lat'], row['lon'], now)
+        if rid is None:
+            return None, slot
+        req = db.session.get(StopRequest, rid)
+        if req is None or req.status != 'pending':
+            recent.forget(line_code, rid)
+            continue
+
+        # Conditional on still being pending: an approval may have landed since the read
+        result = db.session.execute(
+            update(StopRequest)
+            .where(StopRequest.id == rid, StopRequest.status == 'pending')
+            .values(count=func.coalesce(StopRequest.count, 1) + 1,
+                    last_seen_at=now,
+                    note=merge_notes(req.note, row['note']),
+                    preferred_days=merge_days(req.preferred_days, row['preferred_days']),
+                    preferred_time=req.preferred_time or row['preferred_time'])
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            recent.forget(line_code, rid)
+            continue
+
+        adjust_pending(line_code, 1)
+        if req.cluster_id is not None:
+            add_submissions(req.cluster_id, req.lat, req.lon)
+        recent.remember(rid, line_code, req.lat, req.lon, now)
+        db.session.expire(req)
+        return rid, None
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from app_logic.utils.geodata import DATA_DIR, get_layer, store
+
+
+FLAT_DIR = 'flat'
+FLAT_LAYERS = ('stops', 'lines', 'roads')
+
+
+def _dir(layer: str, data_dir: str) -> str:
+    return os.path.join(data_dir, FLAT_DIR, layer)
+
+
+# ── Export ────────────────────────────────────────────────────────────────────
+
+def export_layer(layer: str, data_dir: str = DATA_DIR) -> str:
+    """
+    Write a layer (EPSG:4326) as flat .npy arrays under data/flat/<layer>/:
+      coords.npy        (N × 2 float64, lon/lat, contiguous)
+      offsets_<i>.npy   shapely ragged-array offsets (parts, then features)
+      col_<name>.npy    one array per attribute, strings as fixed-width unicode
+      meta.json         geometry type, row count, columns, source_hash
+    Every file is replaced atomically and meta.json goes last, so readers
+    never pair new arrays with an old description.
+    """
+    gdf = get_layer(layer, data_dir)
+    geom_type, coords, offsets = shapely.to_ragged_array(gdf.geometry.values)
+
+    arrays = {'coords': np.ascontiguousarray(coords, dtype=np.float64)}
+    for i, off in enumerate(offsets):
+        arrays[f'offsets_{i}'] = np.asarray(off, dtype=np.int64)
+    columns = []
+    for name in gdf.columns:
+        if name == 'geometry':
+            continue
+        values = gdf[name]
+        if values.dtype.kind in 'biuf':
+            arrays[f'col_{name}'] = values.to_numpy()
+        else:
+            arrays[f'col_{name}'] = values.astype(object).where(values.notna(), '').to_numpy(dtype=str)
+        columns.append(name)
+
+    out = _dir(layer, data_dir)
+    os.makedirs(out, exist_ok=True)
+    for name, arr in arrays.items():
+        tmp = os.path.join(out, f'{name}.tmp.npy')
+        np.save(tmp, arr)
+        os.replace(tmp, os.path.join(out, f'{name}.npy'))
+
+    meta = {
+        'layer': layer,
+        'rows': len(gdf),
+        'geometry_type': int(geom_type),
+        'offsets': len(offsets),
+        'columns': columns,
+        'source_hash': store.content_hash((layer,), data_dir),
+    }
+    tmp = os.path.join(out, 'meta.tmp.json')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(out, 'meta.json'))
+    return out
+
+
+# ── Runtime ───────────────────────────────────────────────────────────────────
+
+class FlatLayer:
+    """
+    A layer memory-mapped from data/flat/<layer>/. Arrays are read-only
+    views of the files, paged in on first touch; nothing here needs
+    geopandas.
+    """
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.source_hash = meta['source_hash']
+        self.columns = meta['columns']
+        self.coords = np.load(os.path.join(path, 'coords.npy'), mmap_mode='r')
+        self.offsets = tuple(np.load(os.path.join(path, f'offsets_{i}.npy'), mmap_mode='r')
+                             for i in range(meta['offsets']))
+        self._geoms = None
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def column(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f'col_{name}.npy'), mmap_mode='r')
+
+    def geometries(self) -> np.ndarray:
+        """Shapely geometries, built from the mapped arrays on first use."""
+        if self._geoms is None:
+            with self._lock:
+                if self._geoms is None:
+                    self._geoms = shapely.from_ragged_array(
+                        shapely.GeometryType(self.meta['geometry_type']), self.coords, self.offsets or None)
+        return self._geoms
+
+    def sindex(self) -> shapely.STRtree:
+        if self._tree is None:
+            tree = shapely.STRtree(self.geometries())
+            with self._lock:
+                self._tree = self._tree or tree
+        return self._tree
+
+
+_layers = {}   # (data_dir, layer) → (source_hash, FlatLayer or None)
+_lock = threading.Lock()
+
+
+def get_flat(layer: str, data_dir: str = DATA_DIR):
+    """
+    Return the memory-mapped layer, or None when it has not been exported
+    ('flask export-binary') or no longer matches the shapefile. Without the
+    shapefile the export is used as is.
+    """
+    key = (os.path.abspath(data_dir), layer)
+    try:
+        current = store.content_hash((layer,), data_dir)
+    except OSError:
+        current = None
+    cached = _layers.get(key)
+    if cached is not None and cached[0] == current:
+        return cached[1]
+
+    with _lock:
+        flat = None
+        path = _dir(layer, data_dir)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            if current is None or meta['source_hash'] == current:
+                flat = FlatLayer(path, meta)
+            else:
+                print(f"flatgeo: {layer} is stale, run 'flask export-binary'")
+        except (OSError, ValueError, KeyError):
+            pass
+        _layers[key] = (current, flat)
+        return flat
@@ -0,0 +1,17 @@
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371008.8
+REF_LAT = 44.494887   # Bologna, same centre as the citizen map
+
+
+def to_local_xy(lat, lon, ref_lat: float = REF_LAT):
+    """
+    Equirectangular projection to metres around ref_lat.
+    Accurate to well under 1% across the Bologna metro area, and cheap
+    enough to run on whole coordinate arrays.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    k = np.pi / 180.0 * EARTH_RADIUS_M
+    return lon * k * np.cos(np.radians(ref_lat)), lat * k
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import time
+
+import shapely
+
+from app_logic.utils.metrics import span
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
+
+# Map layer name → shapefile in data/
+LAYER_FILES = {
+    'stops': 'fermate_bus.shp',
+    'lines': 'linee_bus.shp',
+    'roads': 'strade.shp',
+    'buildings': 'edifici.shp',
+}
+
+
+def _signature(shp_path: str) -> tuple:
+    """(mtime, size) of the .shp and .dbf — changes whenever the layer is replaced."""
+    sig = []
+    for path in (shp_path, os.path.splitext(shp_path)[0] + '.dbf'):
+        st = os.stat(path)
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def _memory_bytes(gdf) -> int:
+    attrs = int(gdf.drop(columns='geometry').memory_usage(deep=True).sum())
+    coords = int(shapely.get_num_coordinates(gdf.geometry.values).sum()) * 16
+    return attrs + coords
+
+
+# ── Process-wide layer store ──────────────────────────────────────────────────
+
+class GeoDataStore:
+    """
+    Loads each shapefile layer once per worker, already reprojected to
+    EPSG:4326, and reloads it only when the files on disk change.
+    """
+
+    def __init__(self):
+        self._layers = {}   # (data_dir, layer) → {'gdf', 'signature', 'load_seconds', 'memory_bytes'}
+        self._hashes = {}   # (data_dir, layers) → (signatures, sha1)
+        self._lock = threading.Lock()
+
+    def get(self, layer: str, data_dir: str = DATA_DIR):
+        """
+        Return the layer as a GeoDataFrame in EPSG:4326.
+        The result is a shallow copy: with pandas copy-on-write, callers can
+        filter or add columns without touching the shared frame.
+        """
+        entry = self._entry(layer, data_dir)
+        return entry['gdf'].copy(deep=False)
+
+    def sindex(self, layer: str, data_dir: str = DATA_DIR):
+        """R-tree (shapely STRtree) over the shared frame, built once per load."""
+        return self._entry(layer, data_dir)['gdf'].sindex
+
+    def signature(self, layer: str, data_dir: str = DATA_DIR) -> tuple:
+        """File signature of a layer, without loading it."""
+        return _signature(self.path(layer, data_dir))
+
+    def path(self, layer: str, data_dir: str = DATA_DIR) -> str:
+        return os.path.join(data_dir, LAYER_FILES[layer])
+
+    def content_hash(self, layers, data_dir: str = DATA_DIR) -> str:
+        """
+        SHA-1 of the .shp/.dbf of the given layers, used to key derived files
+        written next to the data. Recomputed only when a signature changes.
+        """
+        key = (os.path.abspath(data_dir), tuple(layers))
+        sigs = tuple(self.signature(layer, data_dir) for layer in layers)
+        memo = self._hashes.get(key)
+        if memo and memo[0] == sigs:
+            return memo[1]
+
+        h = hashlib.sha1()
+        for layer in layers:
+            base = os.path.splitext(self.path(layer, data_dir))[0]
+            for ext in ('.shp', '.dbf'):
+                with open(base + ext, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[key] = (sigs, digest)
+        return digest
+
+    def stats(self) -> list:
+        """Load time and approximate memory of every layer currently held."""
+        return [
+            {
+                'layer': layer,
+                'data_dir': data_dir,
+                'rows': len(entry['gdf']),
+                'load_seconds': round(entry['load_seconds'], 4),
+                'memory_bytes': entry['memory_bytes'],
+            }
+            for (data_dir, layer), entry in sorted(self._layers.items())
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
+
+    def _entry(self, layer: str, data_dir: str) -> dict:
+        key = (os.path.abspath(data_dir), layer)
+        sig = self.signature(layer, data_dir)
+        entry = self._layers.get(key)
+        if entry is not None and entry['signature'] == sig:
+            return entry
+
+        with self._lock:
+            entry = self._layers.get(key)
+            if entry is not None and entry['signature'] == sig:
+                return entry
+
+            # Imported here so signatures and hashes (and the flat-array hot
+            # paths built on them) never load geopandas
+            import geopandas as gpd
+
+            t0 = time.perf_counter()
+            with span(f'geodata.read.{layer}'):
+                gdf = gpd.read_file(self.path(layer, data_dir))
+            if gdf.crs and gdf.crs.to_epsg() != 4326:
+                with span(f'geodata.reproject.{layer}'):
+                    gdf = gdf.to_crs('EPSG:4326')
+            elapsed = time.perf_counter() - t0
+
+            entry = {
+                'gdf': gdf,
+                'signature': sig,
+                'load_seconds': elapsed,
+                'memory_bytes': _memory_bytes(gdf),
+            }
+            self._layers[key] = entry
+            print(f"geodata: loaded {layer} ({len(gdf)} rows) in {elapsed:.2f}s, "
+                  f"~{entry['memory_bytes'] / 1e6:.1f} MB")
+            return entry
+
+
+store = GeoDataStore()
+
+
+def get_layer(layer: str, data_dir: str = DATA_DIR):
+    """Shortcut for store.get() on the process-wide store."""
+    return store.get(layer, data_dir)
@@ -0,0 +1,95 @@
+import math
+
+from sqlalchemy import Integer, cast, func
+
+from app_logic import db
+from app_logic.models import StopRequest
+from app_logic.utils.cache import LRUCache
+
+
+CELLS_PER_TILE = 16   # grid resolution: cells across one XYZ tile at the requested zoom
+RAW_ZOOM = 17         # from this zoom up, individual points are streamed instead of cells
+
+_cache = LRUCache(256)
+
+
+def cell_size(zoom: int) -> float:
+    """Grid cell edge in degrees for a zoom level."""
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+def snap_bbox(bbox, zoom: int) -> tuple:
+    """Expand (w, s, e, n) outward to whole grid cells so nearby viewports share cache entries."""
+    size = cell_size(zoom) * CELLS_PER_TILE
+    w, s, e, n = bbox
+    return (math.floor(w / size) * size, math.floor(s / size) * size,
+            math.ceil(e / size) * size, math.ceil(n / size) * size)
+
+
+def pending_version() -> tuple:
+    """Changes whenever a request is added, approved or rejected, or absorbs a repeat submission."""
+    newest = db.session.query(func.max(StopRequest.id)).scalar()
+    pending = db.session.query(func.sum(StopRequest.count)).filter(StopRequest.status == 'pending').scalar()
+    return newest, pending
+
+
+def _pending_in(bbox, lines):
+    w, s, e, n = bbox
+    q = StopRequest.query.filter(StopRequest.status == 'pending',
+                                 StopRequest.lat >= s, StopRequest.lat <= n,
+                                 StopRequest.lon >= w, StopRequest.lon <= e)
+    if lines:
+        q = q.filter(StopRequest.line_code.in_(lines))
+    return q
+
+
+def binned_pending(bbox, zoom: int, lines=None) -> dict:
+    """
+    Pending requests inside bbox aggregated into a square grid with SQL GROUP BY.
+    Cached per snapped bbox, zoom, line filter and pending_version().
+    """
+    zoom = max(0, min(int(zoom), RAW_ZOOM - 1))
+    bbox = snap_bbox(bbox, zoom)
+    lines = tuple(sorted(lines or ()))
+    key = (bbox, zoom, lines, pending_version())
+
+    def compute():
+        size = cell_size(zoom)
+        # floor before the cast: CAST truncates on SQLite but rounds on PostgreSQL
+        gx = cast(func.floor(StopRequest.lon / size), Integer)
+        gy = cast(func.floor(StopRequest.lat / size), Integer)
+        # Marker at the centroid weighted by submissions, like the cell count
+        total = func.sum(StopRequest.count)
+        rows = (_pending_in(bbox, lines)
+                .with_entities(gx, gy, total, func.sum(StopRequest.lat * StopRequest.count) / total,
+                               func.sum(StopRequest.lon * StopRequest.count) / total)
+                .group_by(gx, gy)
+                .all())
+        cells = []
+        for x, y, count, lat, lon in rows:
+            x0, y0 = x * size, y * size
+            cells.append({
+                'lat': float(lat),
+                'lon': float(lon),
+                'count': int(count),
+                'bounds': [x0, y0, x0 + size, y0 + size],
+            })
+        return {
+            'mode': 'cells',
+            'zoom': zoom,
+            'cell_size': size,
+            'bbox': list(bbox),
+            'total': sum(c['count'] for c in cells),
+            'cells': cells,
+        }
+
+    return _cache.get_or_compute(key, compute)
+
+
+def iter_pending_points(bbox, lines=None, batch: int = 1000):
+    """Raw pending points inside bbox, fetched in batches: (lat, lon, line_code, count) tuples."""
+    q = (_pending_in(bbox, lines)
+         .with_entities(StopRequest.lat, StopRequest.lon, StopRequest.line_code, StopRequest.count)
+         .execution_options(yield_per=batch))
+    for row in q:
+        yield row
@@ -0,0 +1,167 @@
+import json
+import math
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app_logic import db
+from app_logic.models import StopRequest
+from app_logic.utils.cluster_store import assign_requests
+from app_logic.utils.live_routes import adjust_pending
+
+
+CHUNK_SIZE = 5000
+MAX_ERRORS = 1000   # per-row errors kept in the report; the rest are only counted
+
+STATUSES = ('pending', 'approved', 'rejected')
+
+
+# ── Validation ────────────────────────────────────────────────────────────────
+
+def _text(record: dict, field: str, limit: int) -> str:
+    value = record.get(field)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f'{field} non valido')
+    return value.strip()[:limit]
+
+
+def _coord(value, low: float, high: float):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) and low <= value <= high else None
+
+
+def parse_record(record) -> dict:
+    """
+    Validate one decoded NDJSON record and return the row to insert.
+    Same fields as /request-stop, plus optional status and created_at
+    (ISO 8601) for historical requests. Raises ValueError with the reason.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('record non valido')
+
+    line_code = record.get('line_code')
+    if isinstance(line_code, (int, float)) and not isinstance(line_code, bool):
+        line_code = str(line_code)
+    if not isinstance(line_code, str) or not line_code.strip():
+        raise ValueError('line_code mancante')
+    if len(line_code.strip()) > 20:
+        raise ValueError('line_code troppo lungo')
+
+    lat = _coord(record.get('lat'), -90, 90)
+    lon = _coord(record.get('lon'), -180, 180)
+    if lat is None or lon is None:
+        raise ValueError('lat/lon non validi')
+
+    status = record.get('status') or 'pending'
+    if status not in STATUSES:
+        raise ValueError('status non valido')
+
+    created_at = record.get('created_at')
+    if created_at:
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise ValueError('created_at non valido')
+    else:
+        created_at = datetime.utcnow()
+
+    return {
+        'line_code': line_code.strip(),
+        'lat': lat,
+        'lon': lon,
+        'note': _text(record, 'note', 300),
+        'preferred_days': _text(record, 'preferred_days', 100),
+        'preferred_time': _text(record, 'preferred_time', 20),
+        'status': status,
+        'created_at': created_at,
+    }
+
+
+# ── Bulk insert ───────────────────────────────────────────────────────────────
+
+def insert_rows(rows: list) -> list:
+    """
+    Insert validated rows with one executemany-style statement and apply
+    the side effects of new requests: pending counts of the materialized
+    routes and cluster assignment. Does not commit. Returns the new ids in
+    the order of rows.
+    """
+    stmt = insert(StopRequest).returning(StopRequest.id, sort_by_parameter_order=True)
+    ids = db.session.execute(stmt, rows).scalars().all()
+    pending = [(i, r['line_code'], r['lat'], r['lon'], r.get('count', 1))
+               for i, r in zip(ids, rows) if r['status'] == 'pending']
+    demand = Counter()
+    for p in pending:
+        demand[p[1]] += p[4]
+    for line_code, n in demand.items():
+        adjust_pending(line_code, n)
+    assign_requests(pending)
+    return ids
+
+
+def ingest_lines(lines, chunk_size: int = CHUNK_SIZE, on_chunk=None) -> dict:
+    """
+    Read NDJSON lines (str or bytes) one at a time, validate them and insert
+    every chunk_size valid rows in their own transaction, so memory stays
+    bounded by one chunk. A chunk the database refuses is rolled back and
+    reported against each of its lines. on_chunk(report) is called after
+    every commit. Returns the report: read, inserted, error_count, errors
+    (first MAX_ERRORS as {line, error}), seconds, rows_per_sec.
+    """
+    report = {'read': 0, 'inserted': 0, 'error_count': 0, 'errors': [], 'seconds': 0.0, 'rows_per_sec': 0.0}
+    t0 = time.perf_counter()
+
+    def error(lineno, message):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_ERRORS:
+            report['errors'].append({'line': lineno, 'error': message})
+
+    def flush(rows, linenos):
+        try:
+            insert_rows(rows)
+            db.session.commit()
+            report['inserted'] += len(rows)
+        except Exception as e:
+            db.session.rollback()
+            print(f"ingest error: {e}")
+            for lineno in linenos:
+                error(lineno, 'inserimento fallito')
+        elapsed = time.perf_counter() - t0
+        report['seconds'] = round(elapsed, 3)
+        report['rows_per_sec'] = round(report['inserted'] / elapsed, 1) if elapsed else 0.0
+        if on_chunk is not None:
+            on_chunk(report)
+
+    rows, linenos = [], []
+    for lineno, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        report['read'] += 1
+        try:
+            rows.append(parse_record(json.loads(line)))
+            linenos.append(lineno)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            error(lineno, 'JSON non valido')
+            continue
+        except ValueError as e:
+            error(lineno, str(e))
+            continue
+        if len(rows) >= chunk_size:
+            flush(rows, linenos)
+            rows, linenos = [], []
+
+    if rows:
+        flush(rows, linenos)
+    elapsed = time.perf_counter() - t0
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_sec'] = round(report['inserted'] / elapsed, 1) if elapsed else 0.0
+    return report
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from app_logic.utils.cache import LRUCache
+from app_logic.utils.coverage import score_points
+from app_logic.utils.metrics import span
+from app_logic.utils.optimizer import optimize_route
+
+
+class PreviewJobs:
+    """
+    Before/after previews computed on a thread pool.
+    Results are cached by (line, route version, point, metric), so a preview
+    requested again after the dashboard prefetched it is a dictionary hit;
+    a new approval on the line bumps the version and retires old entries.
+    """
+
+    def __init__(self, workers: int = 2, cache_size: int = 2048):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preview')
+        self._results = LRUCache(cache_size)
+        self._jobs = LRUCache(cache_size)   # job id → Future
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(line_code: str, version: int, lat: float, lon: float, metric: str) -> tuple:
+        return (line_code, version, round(float(lat), 6), round(float(lon), 6), metric)
+
+    @staticmethod
+    def job_id(key: tuple) -> str:
+        return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+    def cached(self, key: tuple):
+        return self._results.get(key)
+
+    def submit(self, key: tuple, base: list, data_dir: str):
+        """
+        Return (result, job_id): the cached result if there is one, otherwise
+        None and the id of the job computing it (started if not already running).
+        A job that failed is started again, so a transient error does not stick.
+        """
+        result = self._results.get(key)
+        if result is not None:
+            return result, self.job_id(key)
+
+        job_id = self.job_id(key)
+        with self._lock:
+            future = self._jobs.get(job_id)
+            if future is None or (future.done() and future.exception() is not None):
+                self._jobs.set(job_id, self._pool.submit(self._compute, key, base, data_dir))
+        return None, job_id
+
+    def wait(self, job_id: str, timeout: float):
+        """
+        Result of a job if it finishes within timeout seconds, else None.
+        A failed job is logged and also gives None: status() tells it apart.
+        """
+        future = self._jobs.get(job_id)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            return None
+        except Exception as e:
+            print(f"preview job {job_id} failed: {e!r}")
+            return None
+
+    def status(self, job_id: str) -> str:
+        future = self._jobs.get(job_id)
+        if future is None:
+            return 'unknown'
+        if not future.done():
+            return 'running'
+        return 'failed' if future.exception() else 'done'
+
+    @span('preview.compute')
+    def _compute(self, key: tuple, base: list, data_dir: str) -> dict:
+        line_code, version, lat, lon, metric = key
+        after, insert_idx = optimize_route(line_code, lat, lon, data_dir, metric=metric, base=base)
+        result = {
+            'new_point': {'lat': lat, 'lon': lon},
+            'coverage': score_points(lat, lon, data_dir)[0],
+            'before': base,
+            'after': after,
+            'line_code': line_code,
+            'insert_idx': insert_idx,
+            'version': version,
+        }
+        self._results.set(key, result)
+        return result
@@ -0,0 +1,77 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app_logic import db
+from app_logic.models import ApprovedStop, LineRoute, StopRequest
+from app_logic.utils.metrics import span
+from app_logic.utils.optimizer import get_full_route
+from app_logic.utils.stop_index import get_index, source_hash
+
+
+@span('route.rebuild')
+def rebuild_route(line_code: str, data_dir: str) -> LineRoute:
+    """
+    Recompute a line's materialized route and pending count, bumping its
+    version. Adds the row to the session; the caller commits.
+    """
+    approved = ApprovedStop.query.filter_by(line_code=line_code).order_by(ApprovedStop.id).all()
+    stops = get_full_route(line_code, data_dir, approved)
+    pending = (db.session.query(func.coalesce(func.sum(StopRequest.count), 0))
+               .filter(StopRequest.line_code == line_code, StopRequest.status == 'pending')
+               .scalar())
+
+    row = db.session.get(LineRoute, line_code)
+    if row is None:
+        row = LineRoute(line_code=line_code, version=0)
+        db.session.add(row)
+    row.version = (row.version or 0) + 1
+    row.stops_json = json.dumps(stops)
+    row.source_hash = source_hash(data_dir)
+    row.pending_count = pending
+    row.updated_at = datetime.utcnow()
+    return row
+
+
+def line_exists(line_code: str, data_dir: str) -> bool:
+    """True if the line has stops in the stop index or approved stops in the database."""
+    if get_index(data_dir).has_line(line_code):
+        return True
+    return db.session.query(ApprovedStop.id).filter_by(line_code=line_code).first() is not None
+
+
+@span('route.live')
+def get_live_route(line_code: str, data_dir: str) -> LineRoute:
+    """
+    One primary-key read of the materialized route, rebuilt first if it is
+    missing or was built from an older stop index. A line that is neither in
+    the stop index nor has approved stops is not materialized: it gets an
+    empty, unsaved route with version 0.
+    """
+    row = db.session.get(LineRoute, line_code)
+    if row is not None and row.source_hash == source_hash(data_dir):
+        return row
+    if row is None and not line_exists(line_code, data_dir):
+        return LineRoute(line_code=line_code, version=0, stops_json='[]',
+                         source_hash=source_hash(data_dir), pending_count=0)
+
+    rebuild_route(line_code, data_dir)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker materialized the line first
+        db.session.rollback()
+    return db.session.get(LineRoute, line_code)
+
+
+def adjust_pending(line_code: str, delta: int):
+    """
+    Keep the materialized pending count in step with request inserts and
+    decisions. It counts submissions, so a request that absorbed repeats
+    weighs its count.
+    """
+    LineRoute.query.filter_by(line_code=line_code).update(
+        {'pending_count': LineRoute.pending_count + delta}, synchronize_session=False
+    )
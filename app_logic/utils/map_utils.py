@@ -1,12 +1,102 @@
 import folium
 
-import geopandas as gpd
+import json
 
 import os
 
+import numpy as np
 
+import shapely
 
-def create_map(enabled_layers=None, selected_lines=None):
+from app_logic.utils.flatgeo import get_flat
+
+from app_logic.utils.geodata import get_layer
+
+from app_logic.utils.metrics import span
+
+from app_logic.utils.pyramid import MAP_ZOOM, get_pyramid
+
+
+
+def _simplified_layer(layer, data_dir):
+
+    """Precomputed simplification level when available, otherwise simplify now."""
+
+    pyramid = get_pyramid(layer, data_dir)
+
+    if pyramid is not None:
+
+        return json.loads(pyramid.feature_collection(MAP_ZOOM))
+
+    gdf = get_layer(layer, data_dir)
+
+    gdf['geometry'] = gdf.simplify(tolerance=0.0001, preserve_topology=True)
+
+    return gdf
+
+
+
+def _flat_lines(data_dir, selected_lines):
+
+    """Bus lines as a GeoJSON dict from the memory-mapped export, or None if there is none."""
+
+    flat = get_flat('lines', data_dir)
+
+    if flat is None:
+
+        return None
+
+    codes = flat.column('codLinea')
+
+    rows = np.flatnonzero(np.isin(codes, selected_lines)) if selected_lines else np.arange(len(flat))
+
+    geoms = shapely.to_geojson(flat.geometries()[rows])
+
+    return {
+
+        'type': 'FeatureCollection',
+
+        'features': [
+
+            {'type': 'Feature', 'properties': {'codLinea': str(codes[i])}, 'geometry': json.loads(g)}
+
+            for i, g in zip(rows, geoms)
+
+        ],
+
+    }
+
+
+
+def _stop_rows(data_dir, selected_lines):
+
+    """(lat, lon, name, line) of every stop to draw, from the memory-mapped export when there is one."""
+
+    flat = get_flat('stops', data_dir)
+
+    if flat is not None:
+
+        codes = flat.column('codLinea')
+
+        names = flat.column('nomeFermat') if 'nomeFermat' in flat.columns else np.full(len(flat), 'N/A')
+
+        rows = np.flatnonzero(np.isin(codes, selected_lines)) if selected_lines else np.arange(len(flat))
+
+        return zip(flat.coords[rows, 1].tolist(), flat.coords[rows, 0].tolist(), names[rows].tolist(), codes[rows].tolist())
+
+    stops = get_layer('stops', data_dir)
+
+    if selected_lines:
+
+        stops = stops[stops['codLinea'].isin(selected_lines)]
+
+    return ((row.geometry.y, row.geometry.x, row.get('nomeFermat', 'N/A'), row.get('codLinea', 'N/A'))
+
+            for _, row in stops.iterrows())
+
+
+
+def create_map(enabled_layers=None, selected_lines=None, tiled_layers=None):
 
     if enabled_layers is None:
 
@@ -14,6 +104,12 @@ def create_map(enabled_layers=None, selected_lines=None):
 
 
 
+    # Layers in tiled_layers are fetched by the browser from /api/tiles instead of being inlined
+
+    inline_layers = [l for l in enabled_layers if l not in (tiled_layers or [])]
+
+
+
     # Center map on Bologna
 
     m = folium.Map(location=[44.494887, 11.3426163], zoom_start=13)
@@ -34,97 +130,87 @@ def create_map(enabled_layers=None, selected_lines=None):
 
     try:
 
-        if 'buildings' in enabled_layers:
-
-            buildings = gpd.read_file(os.path.join(data_dir, 'edifici.shp'))
+        if 'buildings' in inline_layers:
 
-            if buildings.crs != 'EPSG:4326':
+            with span('map.data.buildings'):
 
-                buildings = buildings.to_crs('EPSG:4326')
+                buildings = _simplified_layer('buildings', data_dir)
 
-            buildings['geometry'] = buildings.simplify(tolerance=0.0001, preserve_topology=True)
+            with span('map.folium.buildings'):
 
-            folium.GeoJson(buildings, name='Buildings', style_function=lambda x: {'color': 'gray', 'weight': 1}).add_to(m)
+                folium.GeoJson(buildings, name='Buildings', style_function=lambda x: {'color': 'gray', 'weight': 1}).add_to(m)
 
 
 
-        if 'roads' in enabled_layers:
+        if 'roads' in inline_layers:
 
-            roads = gpd.read_file(os.path.join(data_dir, 'strade.shp'))
+            with span('map.data.roads'):
 
-            if roads.crs != 'EPSG:4326':
+                roads = _simplified_layer('roads', data_dir)
 
-                roads = roads.to_crs('EPSG:4326')
+            with span('map.folium.roads'):
 
-            roads['geometry'] = roads.simplify(tolerance=0.0001, preserve_topology=True)
+                folium.GeoJson(roads, name='Roads', style_function=lambda x: {'color': 'black', 'weight': 2}).add_to(m)
 
-            folium.GeoJson(roads, name='Roads', style_function=lambda x: {'color': 'black', 'weight': 2}).add_to(m)
 
 
+        if 'lines' in inline_layers:
 
-        if 'lines' in enabled_layers:
+            with span('map.data.lines'):
 
-            lines = gpd.read_file(os.path.join(data_dir, 'linee_bus.shp'))
+                lines = _flat_lines(data_dir, selected_lines)
 
-            if lines.crs != 'EPSG:4326':
+                if lines is None:
 
-                lines = lines.to_crs('EPSG:4326')
+                    lines = get_layer('lines', data_dir)
 
-           
+                    if selected_lines:
 
-            if selected_lines:
+                        lines = lines[lines['codLinea'].isin(selected_lines)]
 
-                lines = lines[lines['codLinea'].isin(selected_lines)]
 
 
+            with span('map.folium.lines'):
 
-            folium.GeoJson(
+                folium.GeoJson(
 
-                lines,
+                    lines,
 
-                name='Bus Lines',
+                    name='Bus Lines',
 
-                style_function=lambda x: {'color': 'blue', 'weight': 3},
+                    style_function=lambda x: {'color': 'blue', 'weight': 3},
 
-                tooltip=folium.GeoJsonTooltip(fields=['codLinea'], aliases=['Route Line:'])
+                    tooltip=folium.GeoJsonTooltip(fields=['codLinea'], aliases=['Route Line:'])
 
-            ).add_to(m)
+                ).add_to(m)
 
        
 
-        if 'stops' in enabled_layers:
-
-            stops = gpd.read_file(os.path.join(data_dir, 'fermate_bus.shp'))
-
-            if stops.crs != 'EPSG:4326':
-
-                stops = stops.to_crs('EPSG:4326')
+        if 'stops' in inline_layers:
 
-           
+            with span('map.data.stops'):
 
-            if selected_lines:
+                stop_rows = list(_stop_rows(data_dir, selected_lines))
 
-                stops = stops[stops['codLinea'].isin(selected_lines)]
+            with span('map.folium.stops'):
 
+                for lat, lon, name, line in stop_rows:
 
+                    folium.CircleMarker(
 
-            for idx, row in stops.iterrows():
+                        location=[lat, lon],
 
-                folium.CircleMarker(
+                        radius=3,
 
-                    location=[row.geometry.y, row.geometry.x],
+                        color='red',
 
-                    radius=3,
+                        fill=True,
 
-                    color='red',
+                        fill_color='red',
 
-                    fill=True,
+                        popup=f"Stop: {name}<br>Lines: {line}"
 
-                    fill_color='red',
-
-                    popup=f"Stop: {row.get('nomeFermat', 'N/A')}<br>Lines: {row.get('codLinea', 'N/A')}"
-
-                ).add_to(m)
+                    ).add_to(m)
 
 
 
@@ -0,0 +1,241 @@
+import bisect
+import hmac
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import Response, g, request, session
+from sqlalchemy import event
+
+
+# Upper bounds in seconds (durations) and in queries per request
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+SQL_OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+HTTP_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+# ── Histograms ────────────────────────────────────────────────────────────────
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    A labelled Prometheus histogram kept in process memory. Each series
+    holds per-bucket counts (the last one is +Inf) and the sum of the
+    observed values; exposition makes the buckets cumulative.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}   # label values → [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def expose(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            base = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+            sep = ',' if base else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            suffix = f'{{{base}}}' if base else ''
+            lines.append(f'{self.name}_sum{suffix} {_number(values[-1])}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+REQUEST_SECONDS = Histogram('tper_request_seconds', 'HTTP request duration.', ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram('tper_request_db_queries', 'Database queries issued per HTTP request.',
+                            ('endpoint',), COUNT_BUCKETS)
+DB_QUERY_SECONDS = Histogram('tper_db_query_seconds', 'Duration of single database statements.', ('operation',))
+SPAN_SECONDS = Histogram('tper_span_seconds', 'Duration of instrumented stages (shapefile I/O, '
+                         'reprojection, insertion search, folium rendering, ...).', ('span',))
+
+REGISTRY = (REQUEST_SECONDS, REQUEST_QUERIES, DB_QUERY_SECONDS, SPAN_SECONDS)
+
+
+def expose() -> str:
+    """All histograms in the Prometheus text exposition format."""
+    lines = []
+    for histogram in REGISTRY:
+        lines.extend(histogram.expose())
+    return '\n'.join(lines) + '\n'
+
+
+# ── Spans ─────────────────────────────────────────────────────────────────────
+
+class RequestStats:
+    """What one request spent in the database and, when it is traced, in each span."""
+
+    __slots__ = ('queries', 'db_seconds', 'spans')
+
+    def __init__(self, traced: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.spans = [] if traced else None   # (name, seconds) in completion order
+
+
+_current = ContextVar('tper_request_stats', default=None)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a stage. Every span feeds the tper_span_seconds histogram; inside a
+    traced request it is also listed in the response's Server-Timing header.
+    Usable as a decorator as well.
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        SPAN_SECONDS.observe(elapsed, name)
+        stats = _current.get()
+        if stats is not None and stats.spans is not None:
+            stats.spans.append((name, elapsed))
+
+
+def current_stats():
+    """RequestStats of the request being served, or None outside a request."""
+    return _current.get()
+
+
+# ── SQLAlchemy ────────────────────────────────────────────────────────────────
+
+def _operation(statement: str) -> str:
+    op = statement.lstrip()[:6].upper()
+    return op if op in SQL_OPERATIONS else 'OTHER'
+
+
+def instrument_engine(engine):
+    """Time every statement on the engine and count it against the current request."""
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        DB_QUERY_SECONDS.observe(elapsed, _operation(statement))
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    def on_error(context):
+        started = context.connection.info.get('metrics_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    event.listen(engine, 'before_cursor_execute', before)
+    event.listen(engine, 'after_cursor_execute', after)
+    event.listen(engine, 'handle_error', on_error)
+
+
+# ── Flask ─────────────────────────────────────────────────────────────────────
+
+def _server_timing(stats: RequestStats, total: float) -> str:
+    """Spans summed by name, plus the database and the whole request, as a Server-Timing header."""
+    totals = {}
+    for name, seconds in stats.spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in totals.items()]
+    parts.append(f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries"')
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def _authorized(token: str) -> bool:
+    """Admin session, or Authorization: Bearer <METRICS_TOKEN> when a token is configured."""
+    if session.get('is_admin', False):
+        return True
+    auth = request.headers.get('Authorization', '')
+    return bool(token) and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:], token)
+
+
+def init_metrics(app):
+    """
+    Request hooks and the /metrics endpoint. Every request feeds the
+    histograms; a TRACE_SAMPLE_RATE share of them is also traced into a
+    one-line log. Authorized clients (admin session or METRICS_TOKEN) can
+    force tracing on or off with TRACE_HEADER: 1 / 0, get the spans in a
+    Server-Timing header and read /metrics.
+    """
+    sample_rate = app.config['TRACE_SAMPLE_RATE']
+    header = app.config['TRACE_HEADER']
+    token = app.config['METRICS_TOKEN']
+
+    @app.before_request
+    def start_request():
+        forced = request.headers.get(header)
+        authorized = forced is not None and _authorized(token)
+        if authorized and forced in ('0', '1'):
+            traced = forced == '1'
+        else:
+            traced = random.random() < sample_rate
+        stats = RequestStats(traced)
+        g.metrics = (time.perf_counter(), stats, _current.set(stats), authorized)
+
+    @app.after_request
+    def finish_request(response):
+        started = g.get('metrics')
+        if started is None:
+            return response
+        total = time.perf_counter() - started[0]
+        stats = started[1]
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        REQUEST_SECONDS.observe(total, endpoint, method, str(response.status_code))
+        REQUEST_QUERIES.observe(stats.queries, endpoint)
+        if stats.spans is not None:
+            timing = _server_timing(stats, total)
+            if started[3]:
+                response.headers['Server-Timing'] = timing
+            print(f"trace: {request.method} {request.full_path.rstrip('?')} {response.status_code} {timing}")
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        started = g.pop('metrics', None)
+        if started is not None:
+            try:
+                _current.reset(started[2])
+            except ValueError:
+                # Reset from another context (streamed responses): just detach
+                _current.set(None)
+
+    def metrics():
+        if not _authorized(token):
+            return Response('forbidden\n', status=403, mimetype='text/plain')
+        return Response(expose(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
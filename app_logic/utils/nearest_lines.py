@@ -0,0 +1,110 @@
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from app_logic.utils.flatgeo import get_flat
+from app_logic.utils.geo import to_local_xy
+from app_logic.utils.geodata import DATA_DIR, get_layer, store
+
+
+START_RADIUS_M = 250.0
+MAX_RADIUS_M = 64_000.0   # past this the remaining points are measured against every segment
+
+
+class LineIndex:
+    """
+    STRtree over the distinct arcs of linee_bus.shp, in local metres.
+    Lines share most of their arcs, so each arc is measured once per point
+    and its distance handed to every line that runs along it.
+    """
+
+    def __init__(self, line_codes, geoms, signature):
+        self.signature = signature
+        self.codes, row_code = np.unique(np.asarray(line_codes, dtype=str), return_inverse=True)
+        geoms = shapely.normalize(geoms)
+        _, first, row_arc = np.unique(shapely.to_wkb(geoms), return_index=True, return_inverse=True)
+        self._geoms = shapely.transform(
+            geoms[first], lambda c: np.column_stack(to_local_xy(c[:, 1], c[:, 0]))
+        )
+        # Lines of each arc as CSR: _arc_codes[_arc_ptr[a]:_arc_ptr[a + 1]]
+        pairs = np.unique(np.column_stack([row_arc, row_code]), axis=0)
+        self._arc_codes = pairs[:, 1]
+        self._arc_ptr = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 0], minlength=len(first)))])
+        self._tree = shapely.STRtree(self._geoms)
+
+    def nearest(self, lat, lon, k: int = 5) -> list:
+        """
+        The k lines closest to each point, as one [(line_code, distance_m), ...]
+        list per point, nearest first. The search radius doubles from
+        START_RADIUS_M until k distinct lines are inside it, so every point
+        only measures the arcs around it.
+        """
+        x, y = to_local_xy(np.atleast_1d(lat), np.atleast_1d(lon))
+        points = shapely.points(x, y)
+        n_codes = len(self.codes)
+        k = max(1, min(int(k), n_codes))
+        results = [None] * len(points)
+
+        todo = np.arange(len(points))
+        radius = START_RADIUS_M
+        while todo.size:
+            if radius < MAX_RADIUS_M:
+                p_idx, a_idx = self._tree.query(points[todo], predicate='dwithin', distance=radius)
+            else:
+                # Far outside the network: measure every arc
+                p_idx = np.repeat(np.arange(len(todo)), len(self._geoms))
+                a_idx = np.tile(np.arange(len(self._geoms)), len(todo))
+            arc_dist = shapely.distance(points[todo][p_idx], self._geoms[a_idx])
+
+            # Fan each (point, arc) out to the arc's lines, keep the closest per (point, line)
+            fan = self._arc_ptr[a_idx + 1] - self._arc_ptr[a_idx]
+            p_idx = np.repeat(p_idx, fan)
+            dist = np.repeat(arc_dist, fan)
+            code = self._arc_codes[np.repeat(self._arc_ptr[a_idx + 1] - np.cumsum(fan), fan) + np.arange(fan.sum())]
+            key = p_idx * n_codes + code
+            order = np.lexsort((dist, key))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = key[order][1:] != key[order][:-1]
+            best = order[first]
+            per_point = np.split(best, np.searchsorted(p_idx[best], np.arange(1, len(todo))))
+
+            retry = []
+            for j, rows in enumerate(per_point):
+                if len(rows) < k:
+                    retry.append(j)
+                    continue
+                rows = rows[np.argsort(dist[rows], kind='stable')[:k]]
+                results[todo[j]] = [(str(self.codes[code[r]]), float(dist[r])) for r in rows]
+            todo = todo[retry]
+            radius *= 2
+        return results
+
+
+_indexes = {}   # data_dir → LineIndex
+_lock = threading.Lock()
+
+
+def get_line_index(data_dir: str = DATA_DIR) -> LineIndex:
+    """Line index for data_dir, built once per process and again only when linee_bus.shp changes."""
+    key = os.path.abspath(data_dir)
+    signature = store.signature('lines', data_dir)
+    index = _indexes.get(key)
+    if index is not None and index.signature == signature:
+        return index
+    with _lock:
+        index = _indexes.get(key)
+        if index is None or index.signature != signature:
+            flat = get_flat('lines', data_dir)
+            if flat is not None:
+                index = LineIndex(flat.column('codLinea'), flat.geometries(), signature)
+            else:
+                gdf = get_layer('lines', data_dir)
+                index = LineIndex(gdf['codLinea'].to_numpy(dtype=str), gdf.geometry.values, signature)
+            _indexes[key] = index
+        return index
+
+
+def nearest_lines(lat, lon, k: int = 5, data_dir: str = DATA_DIR) -> list:
+    return get_line_index(data_dir).nearest(lat, lon, k)
@@ -1,97 +1,17 @@
-import os
 import numpy as np
-import geopandas as gpd
+from app_logic.utils.geo import to_local_xy
+from app_logic.utils.geodata import DATA_DIR
+from app_logic.utils.metrics import span
+from app_logic.utils.stop_index import get_index
 
 
-# ── Clustering ────────────────────────────────────────────────────────────────
-
-def cluster_requests(requests, radius_deg=0.003):
-    """
-    Group nearby requests (within ~300m) into a single representative point.
-    Uses a simple greedy radius-based clustering.
-    Returns a list of cluster dicts:
-      { lat, lon, count, line_code, request_ids, notes }
-    """
-    points = [(r.lat, r.lon, r.id, r.line_code, r.note or '') for r in requests]
-    visited = [False] * len(points)
-    clusters = []
-
-    for i, (lat, lon, rid, line, note) in enumerate(points):
-        if visited[i]:
-            continue
-        cluster_pts = [(lat, lon, rid, note)]
-        visited[i] = True
-        for j, (lat2, lon2, rid2, line2, note2) in enumerate(points):
-            if not visited[j] and line2 == line:
-                dist = np.sqrt((lat - lat2) ** 2 + (lon - lon2) ** 2)
-                if dist <= radius_deg:
-                    cluster_pts.append((lat2, lon2, rid2, note2))
-                    visited[j] = True
-
-        # Centroid
-        c_lat = np.mean([p[0] for p in cluster_pts])
-        c_lon = np.mean([p[1] for p in cluster_pts])
-        clusters.append({
-            'lat': float(c_lat),
-            'lon': float(c_lon),
-            'count': len(cluster_pts),
-            'line_code': line,
-            'request_ids': [p[2] for p in cluster_pts],
-            'notes': [p[3] for p in cluster_pts if p[3]],
-        })
-
-    return clusters
-
-
-# ── Existing stops from shapefile ─────────────────────────────────────────────
+# ── Existing stops from the stop index ────────────────────────────────────────
 
 def get_existing_stops(line_code: str, data_dir: str) -> list:
-    """Return the existing ordered stops for a line from the shapefile."""
+    """Return the existing ordered stops for a line from the precomputed stop index."""
     try:
-        # Load stops
-        stops = gpd.read_file(os.path.join(data_dir, 'fermate_bus.shp'))
-        if stops.crs and stops.crs.to_epsg() != 4326:
-            stops = stops.to_crs('EPSG:4326')
-        line_stops = stops[stops['codLinea'] == line_code].copy()
-        
-        if line_stops.empty:
-            return []
-
-        # Load line geometry to order stops along it
-        lines = gpd.read_file(os.path.join(data_dir, 'linee_bus.shp'))
-        if lines.crs and lines.crs.to_epsg() != 4326:
-            lines = lines.to_crs('EPSG:4326')
-        
-        # Get all arcs for this line and merge them into a single geometry
-        line_geom = lines[lines['codLinea'] == line_code].unary_union
-        
-        if line_geom.is_empty:
-            # Fallback if no line geometry found: just return stops unordered
-            result = []
-            for _, row in line_stops.iterrows():
-                result.append({
-                    'lat': float(row.geometry.y),
-                    'lon': float(row.geometry.x),
-                    'name': str(row.get('nomeFermat', 'Fermata')),
-                    'is_new': False,
-                    'is_approved': False,
-                })
-            return result
-
-        # Project stops onto the line to find their relative position
-        line_stops['dist'] = line_stops.geometry.map(lambda p: line_geom.project(p))
-        line_stops = line_stops.sort_values('dist')
-
-        result = []
-        for _, row in line_stops.iterrows():
-            result.append({
-                'lat': float(row.geometry.y),
-                'lon': float(row.geometry.x),
-                'name': str(row.get('nomeFermat', 'Fermata')),
-                'is_new': False,
-                'is_approved': False,
-            })
-        return result
+        with span('optimizer.existing_stops'):
+            return get_index(data_dir).stops(line_code)
     except Exception as e:
         print(f"get_existing_stops error: {e}")
         return []
@@ -106,48 +26,127 @@ def get_full_route(line_code: str, data_dir: str, approved_stops: list) -> list:
     """
     base = get_existing_stops(line_code, data_dir)
 
-    # Sort approved stops by insert_after descending so insertions don't shift indices
-    sorted_approved = sorted(approved_stops, key=lambda s: (s.insert_after or 0), reverse=True)
-    for s in sorted_approved:
-        idx = min(s.insert_after or len(base), len(base))
-        base.insert(idx, {
-            'lat': s.lat,
-            'lon': s.lon,
-            'name': 'Nuova fermata ✓',
-            'is_new': True,
-            'is_approved': True,
-        })
+    # Replay approvals in the order they happened: each insert_after was chosen
+    # against the route as it was then, including earlier approved stops
+    with span('optimizer.merge_approved'):
+        for s in sorted(approved_stops, key=lambda s: s.id or 0):
+            idx = min(len(base) if s.insert_after is None else s.insert_after, len(base))
+            base.insert(idx, {
+                'lat': s.lat,
+                'lon': s.lon,
+                'name': 'Nuova fermata ✓',
+                'is_new': True,
+                'is_approved': True,
+            })
     return base
 
 
 # ── Cheapest-insertion optimizer ──────────────────────────────────────────────
 
+METRICS = ('euclidean', 'network')
+
+# Upper bound on (candidates × edges) evaluated at once by cheapest_insertions
+_BATCH_CELLS = 1 << 21
+
+
+def _euclidean_costs(route: list, px, py) -> np.ndarray:
+    ax, ay = to_local_xy([s['lat'] for s in route], [s['lon'] for s in route])
+    bx, by = np.roll(ax, -1), np.roll(ay, -1)
+    edge_len = np.hypot(bx - ax, by - ay)
+    cx, cy = px[:, None], py[:, None]
+    return np.hypot(ax - cx, ay - cy) + np.hypot(bx - cx, by - cy) - edge_len
+
+
+@span('optimizer.insertion')
+def cheapest_insertions(route: list, lats, lons, metric: str = 'euclidean', data_dir: str = DATA_DIR) -> tuple:
+    """
+    Vectorized cheapest insertion of many candidate points into a closed route.
+    Edge i joins stop i to stop (i + 1) % n; inserting on it costs
+    d(i, p) + d(p, i+1) - d(i, i+1), in metres, with d either the straight-line
+    distance or the road-network distance (metric='network').
+    Returns (insert_idx, cost) arrays with one entry per candidate.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric!r}")
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    px, py = to_local_xy(lats, lons)
+    network = None
+    if metric == 'network':
+        from app_logic.utils.road_network import get_network   # scipy.sparse only for this metric
+        network = get_network(data_dir)
+
+    best_idx = np.empty(len(px), dtype=np.intp)
+    best_cost = np.empty(len(px))
+    step = max(1, _BATCH_CELLS // max(len(route), 1))
+    for start in range(0, len(px), step):
+        sl = slice(start, start + step)
+        cost = _euclidean_costs(route, px[sl], py[sl])
+        if network is not None:
+            net = network.insertion_costs([s['lat'] for s in route], [s['lon'] for s in route], lats[sl], lons[sl])
+            # Edges beyond the network search are inf; candidates reaching none keep the straight-line score
+            reachable = np.isfinite(net).any(axis=1)
+            cost[reachable] = net[reachable]
+        best = np.argmin(cost, axis=1)
+        best_idx[sl] = best + 1
+        best_cost[sl] = cost[np.arange(len(best)), best]
+    return best_idx, best_cost
+
+
+def rank_insertions(line_code: str, points: list, data_dir: str, approved_stops: list = None,
+                    metric: str = 'euclidean', base: list = None) -> list:
+    """
+    Best insertion for every (lat, lon) candidate of a line in a single call.
+    Returns [{'insert_idx', 'insert_cost_m'}, ...] aligned with points.
+    """
+    if not points:
+        return []
+    if base is None:
+        base = get_full_route(line_code, data_dir, approved_stops or [])
+    if not base:
+        return [{'insert_idx': 0, 'insert_cost_m': None} for _ in points]
+
+    idx, cost = cheapest_insertions(base, [p[0] for p in points], [p[1] for p in points], metric, data_dir)
+    return [{'insert_idx': int(i), 'insert_cost_m': float(c)} for i, c in zip(idx, cost)]
+
+
+def insert_sequentially(route: list, points: list, data_dir: str, metric: str = 'euclidean') -> tuple:
+    """
+    Insert (lat, lon) points one after another at their cheapest edge, each
+    scored against the route that already contains the previous ones.
+    Returns (new_route_list, [insert_after_index, ...]).
+    """
+    route = list(route)
+    indices = []
+    for lat, lon in points:
+        if route:
+            idx, _ = cheapest_insertions(route, lat, lon, metric, data_dir)
+            best_idx = int(idx[0])
+        else:
+            best_idx = 0
+        route.insert(best_idx, {'lat': lat, 'lon': lon, 'name': 'Nuova fermata ✓', 'is_new': True, 'is_approved': True})
+        indices.append(best_idx)
+    return route, indices
+
+
 def optimize_route(line_code: str, new_lat: float, new_lon: float,
-                   data_dir: str, approved_stops: list = None) -> tuple:
+                   data_dir: str, approved_stops: list = None, metric: str = 'euclidean',
+                   base: list = None) -> tuple:
     """
     Find the best insertion position for a new stop.
+    base is the current full route when the caller already has it
+    (e.g. the materialized LineRoute); otherwise it is rebuilt.
     Returns (new_route_list, insert_after_index).
     """
     try:
-        base = get_full_route(line_code, data_dir, approved_stops or [])
+        if base is None:
+            base = get_full_route(line_code, data_dir, approved_stops or [])
         if not base:
             stop = {'lat': new_lat, 'lon': new_lon, 'name': 'Nuova fermata', 'is_new': True, 'is_approved': False}
             return [stop], 0
 
-        new_point = np.array([new_lat, new_lon])
-        best_idx = 0
-        best_cost = float('inf')
-
-        for i in range(len(base)):
-            p1 = np.array([base[i]['lat'], base[i]['lon']])
-            p2 = np.array([base[(i + 1) % len(base)]['lat'],
-                           base[(i + 1) % len(base)]['lon']])
-            cost = (np.linalg.norm(p1 - new_point) +
-                    np.linalg.norm(new_point - p2) -
-                    np.linalg.norm(p1 - p2))
-            if cost < best_cost:
-                best_cost = cost
-                best_idx = i + 1
+        idx, _ = cheapest_insertions(base, new_lat, new_lon, metric, data_dir)
+        best_idx = int(idx[0])
 
         new_stop = {'lat': new_lat, 'lon': new_lon, 'name': 'Nuova fermata ✓', 'is_new': True, 'is_approved': False}
         route = base[:best_idx] + [new_stop] + base[best_idx:]
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+
+import numpy as np
+import shapely
+
+from app_logic.utils.geodata import DATA_DIR, get_layer, store
+
+
+PYRAMID_DIR = 'pyramid'
+PYRAMID_LAYERS = ('roads', 'buildings')
+PYRAMID_ZOOMS = (10, 12, 14, 16)
+MAP_ZOOM = 14   # level used when create_map inlines a layer (closest to its old 0.0001° tolerance)
+
+
+# Properties sent with each feature, per layer
+TILE_PROPERTIES = {
+    'lines': ['codLinea'],
+    'stops': ['codLinea', 'nomeFermat'],
+    'roads': ['name', 'fclass'],
+    'buildings': [],
+}
+
+
+def tolerance_for_zoom(z: int) -> float:
+    """Half a screen pixel at zoom z, in degrees."""
+    return 360.0 / (256 * 2 ** z) / 2
+
+
+def _path(layer: str, data_dir: str) -> str:
+    return os.path.join(data_dir, PYRAMID_DIR, f'{layer}.npz')
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def build_pyramid(layer: str, data_dir: str = DATA_DIR) -> dict:
+    """
+    Simplify a layer once per level in PYRAMID_ZOOMS and store every feature
+    as ready-to-send GeoJSON, so serving a level is a byte join.
+    Returns the arrays written to data/pyramid/<layer>.npz:
+      bounds (N × 4, original geometry), z<zoom>_features (utf-8 bytes),
+      z<zoom>_offsets (N + 1), zooms, source_hash
+    """
+    gdf = get_layer(layer, data_dir)
+    geoms = gdf.geometry.values
+    props = [c for c in TILE_PROPERTIES[layer] if c in gdf.columns]
+    records = gdf[props].astype(object).where(gdf[props].notna(), None).to_dict('records') if props else [{}] * len(gdf)
+    prefixes = ['{"type":"Feature","id":%d,"properties":%s,"geometry":' % (fid, json.dumps(rec, default=str))
+                for fid, rec in zip(gdf.index, records)]
+
+    arrays = {
+        'bounds': shapely.bounds(geoms),
+        'zooms': np.array(PYRAMID_ZOOMS, dtype=np.int64),
+        'source_hash': np.array(store.content_hash((layer,), data_dir)),
+    }
+    for z in PYRAMID_ZOOMS:
+        simplified = shapely.simplify(geoms, tolerance_for_zoom(z), preserve_topology=True)
+        chunks = [
+            (prefix + geom + '}').encode() if geom is not None and not empty else b''
+            for prefix, geom, empty in zip(prefixes, shapely.to_geojson(simplified), shapely.is_empty(simplified))
+        ]
+        arrays[f'z{z}_offsets'] = np.concatenate([[0], np.cumsum([len(c) for c in chunks])]).astype(np.int64)
+        arrays[f'z{z}_features'] = np.frombuffer(b''.join(chunks), dtype=np.uint8)
+    return arrays
+
+
+def write_pyramid(layer: str, arrays: dict, data_dir: str = DATA_DIR) -> str:
+    path = _path(layer, data_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+# ── Runtime ───────────────────────────────────────────────────────────────────
+
+class Pyramid:
+    """Precomputed simplification levels of one layer, with an STRtree over feature bounds."""
+
+    def __init__(self, arrays: dict):
+        self.source_hash = str(arrays['source_hash'])
+        self.zooms = sorted(int(z) for z in arrays['zooms'])
+        self.bounds = arrays['bounds']
+        self._levels = {z: (arrays[f'z{z}_features'].tobytes(), arrays[f'z{z}_offsets']) for z in self.zooms}
+        self._tree = shapely.STRtree(shapely.box(*self.bounds.T)) if len(self.bounds) else None
+
+    def level_for_zoom(self, z: int) -> int:
+        """Finest level not finer than zoom z; the coarsest level for zooms below all levels."""
+        candidates = [lz for lz in self.zooms if lz <= z]
+        return candidates[-1] if candidates else self.zooms[0]
+
+    def features(self, z: int, bbox=None) -> list:
+        """GeoJSON Feature strings at the level for zoom z, optionally inside bbox (w, s, e, n)."""
+        data, offsets = self._levels[self.level_for_zoom(z)]
+        if bbox is None:
+            rows = range(len(offsets) - 1)
+        elif self._tree is None:
+            rows = []
+        else:
+            rows = np.sort(self._tree.query(shapely.box(*bbox)))
+        return [data[offsets[i]:offsets[i + 1]].decode() for i in rows if offsets[i + 1] > offsets[i]]
+
+    def feature_collection(self, z: int, bbox=None) -> str:
+        return '{"type":"FeatureCollection","features":[' + ','.join(self.features(z, bbox)) + ']}'
+
+
+_pyramids = {}   # (data_dir, layer) → ((source_hash, file mtime), Pyramid or None)
+_lock = threading.Lock()
+
+
+def get_pyramid(layer: str, data_dir: str = DATA_DIR):
+    """
+    Return the precomputed pyramid for a layer, or None when it has not been
+    built ('flask build-pyramid') or no longer matches the shapefile.
+    """
+    if layer not in PYRAMID_LAYERS:
+        return None
+    key = (os.path.abspath(data_dir), layer)
+    try:
+        current = store.content_hash((layer,), data_dir)
+    except OSError:
+        return None
+    # The file's mtime is part of the version, so a pyramid built while the
+    # server runs replaces a cached "missing" or "stale" result
+    try:
+        built = os.stat(_path(layer, data_dir)).st_mtime_ns
+    except OSError:
+        built = None
+    cached = _pyramids.get(key)
+    if cached is not None and cached[0] == (current, built):
+        return cached[1]
+
+    with _lock:
+        pyramid = None
+        try:
+            with np.load(_path(layer, data_dir), allow_pickle=False) as f:
+                arrays = {k: f[k] for k in f.files}
+            if str(arrays['source_hash']) == current:
+                pyramid = Pyramid(arrays)
+            else:
+                print(f"pyramid: {layer} is stale, run 'flask build-pyramid'")
+        except (OSError, ValueError, KeyError):
+            pass
+        _pyramids[key] = ((current, built), pyramid)
+        return pyramid
@@ -0,0 +1,228 @@
+import bisect
+import time
+
+import numpy as np
+from sqlalchemy import update
+
+from app_logic import db
+from app_logic.models import ApprovedStop
+from app_logic.utils.geo import to_local_xy
+from app_logic.utils.geodata import DATA_DIR
+from app_logic.utils.live_routes import rebuild_route
+from app_logic.utils.metrics import span
+from app_logic.utils.optimizer import METRICS, get_existing_stops
+
+
+OR_OPT_SEGMENTS = (1, 2, 3)   # lengths of the stop runs Or-opt relocates
+_EPS = 1e-6                   # metres; smaller gains are rounding noise
+
+
+# ── Distances ─────────────────────────────────────────────────────────────────
+
+def distance_matrix(lats, lons, metric: str = 'euclidean', data_dir: str = DATA_DIR) -> np.ndarray:
+    """
+    Symmetric stop-to-stop distances in metres. With metric='network' the
+    road-network distance is averaged over both directions, since 2-opt
+    reverses segments and needs d(a, b) == d(b, a); pairs the network cannot
+    connect keep the straight-line distance.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric!r}")
+    x, y = to_local_xy(lats, lons)
+    d = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    if metric == 'network':
+        from app_logic.utils.road_network import get_network
+        network = get_network(data_dir)
+        net = np.array([network.one_to_many(lat, lon, lats, lons) for lat, lon in zip(lats, lons)])
+        net = np.where(np.isfinite(net), net, d)
+        d = (net + net.T) / 2
+    np.fill_diagonal(d, 0.0)
+    return d
+
+
+def path_length(d: np.ndarray, order) -> float:
+    """Length of the open path visiting order[0] → order[-1]."""
+    order = np.asarray(order)
+    return float(d[order[:-1], order[1:]].sum())
+
+
+# ── Local search ──────────────────────────────────────────────────────────────
+
+def _best_two_opt(d, p, cnt):
+    """
+    Best reversal of positions i..j (1 ≤ i < j ≤ m-2): edges (i-1, i) and
+    (j, j+1) become (i-1, j) and (i, j+1). A reversal may hold at most one
+    locked stop, so locked stops keep their relative order.
+    """
+    m = len(p)
+    if m < 4:
+        return None
+    e = d[p[:-1], p[1:]]
+    inner = np.arange(1, m - 1)
+    delta = (d[np.ix_(p[inner - 1], p[inner])] + d[np.ix_(p[inner], p[inner + 1])]
+             - e[inner - 1][:, None] - e[inner][None, :])
+    i, j = inner[:, None], inner[None, :]
+    delta[(j <= i) | (cnt[j + 1] - cnt[i] > 1)] = np.inf
+    a, b = np.unravel_index(np.argmin(delta), delta.shape)
+    return delta[a, b], int(inner[a]), int(inner[b])
+
+
+def _best_or_opt(d, p, cnt, length):
+    """
+    Best relocation of the run at positions s..s+length-1 (unlocked stops
+    only) onto another edge (k, k+1), either way round.
+    """
+    m = len(p)
+    starts = np.arange(1, m - length)
+    if len(starts) == 0 or m - length < 3:
+        return None
+    starts = starts[cnt[starts + length] - cnt[starts] == 0]
+    if len(starts) == 0:
+        return None
+    e = d[p[:-1], p[1:]]
+    first, last = p[starts], p[starts + length - 1]
+    gain = e[starts - 1] + e[starts + length - 1] - d[p[starts - 1], p[starts + length]]
+
+    fwd = d[np.ix_(first, p[:-1])] + d[np.ix_(last, p[1:])] - e[None, :]
+    rev = d[np.ix_(last, p[:-1])] + d[np.ix_(first, p[1:])] - e[None, :]
+    k = np.arange(m - 1)[None, :]
+    s = starts[:, None]
+    touching = (k >= s - 1) & (k <= s + length - 1)
+    fwd[touching] = np.inf
+    rev[touching] = np.inf
+
+    reverse = rev < fwd
+    delta = np.where(reverse, rev, fwd) - gain[:, None]
+    a, b = np.unravel_index(np.argmin(delta), delta.shape)
+    return delta[a, b], int(starts[a]), int(b), bool(reverse[a, b])
+
+
+def improve_route(d: np.ndarray, locked=None, fix_terminals: bool = True,
+                  time_budget_s: float = 2.0, max_iterations: int = 10000) -> tuple:
+    """
+    Shorten the open path 0 → n-1 over distance matrix d with best-improvement
+    2-opt and Or-opt moves, each scored for every position at once.
+    locked stops keep their relative order (they are never inside an Or-opt
+    run and at most one sits in a 2-opt reversal); with fix_terminals the
+    first and last stop stay in place. Stops when no move gains, when
+    time_budget_s has elapsed or after max_iterations moves.
+    Returns (order, report) with order a permutation of range(n).
+    """
+    t0 = time.perf_counter()
+    n = len(d)
+    locked = np.zeros(n, dtype=bool) if locked is None else np.asarray(locked, dtype=bool)
+    if fix_terminals:
+        dd, lk, p = d, locked, np.arange(n)
+    else:
+        # Two zero-distance dummies as fixed terminals let the real ends move freely
+        dd = np.zeros((n + 2, n + 2))
+        dd[:n, :n] = d
+        lk = np.concatenate([locked, [True, True]])
+        p = np.concatenate([[n], np.arange(n), [n + 1]])
+
+    before = path_length(d, np.arange(n))
+    moves = {'two_opt': 0, 'or_opt': 0}
+    stopped = 'converged'
+    iterations = 0
+    while n >= 3:
+        if iterations >= max_iterations:
+            stopped = 'iterations'
+            break
+        if time.perf_counter() - t0 >= time_budget_s:
+            stopped = 'time'
+            break
+
+        cnt = np.concatenate([[0], np.cumsum(lk[p])])
+        best, kind = _best_two_opt(dd, p, cnt), 'two_opt'
+        for length in OR_OPT_SEGMENTS:
+            move = _best_or_opt(dd, p, cnt, length)
+            if move is not None and (best is None or move[0] < best[0]):
+                best, kind = move + (length,), 'or_opt'
+        if best is None or best[0] >= -_EPS:
+            break
+
+        if kind == 'two_opt':
+            _, i, j = best
+            p = np.concatenate([p[:i], p[i:j + 1][::-1], p[j + 1:]])
+        else:
+            _, s, k, reverse, length = best
+            run = p[s:s + length][::-1] if reverse else p[s:s + length]
+            rest = np.concatenate([p[:s], p[s + length:]])
+            at = k + 1 if k < s else k - length + 1
+            p = np.concatenate([rest[:at], run, rest[at:]])
+        moves[kind] += 1
+        iterations += 1
+
+    order = p if fix_terminals else p[1:-1]
+    after = path_length(d, order)
+    return order.tolist(), {
+        'stops': n,
+        'before_m': round(before, 1),
+        'after_m': round(after, 1),
+        'saved_m': round(before - after, 1),
+        'iterations': iterations,
+        'two_opt_moves': moves['two_opt'],
+        'or_opt_moves': moves['or_opt'],
+        'stopped': stopped,
+        'seconds': round(time.perf_counter() - t0, 4),
+    }
+
+
+# ── Lines ─────────────────────────────────────────────────────────────────────
+
+def replay_insert_after(order: list, is_base: list, approved_ids: list) -> dict:
+    """
+    insert_after for every approved stop such that get_full_route, replaying
+    approvals by id, rebuilds the route in `order`. is_base and approved_ids
+    are indexed like the entries order refers to. Returns {approved_id: index}.
+    """
+    position = {entry: pos for pos, entry in enumerate(order)}
+    placed = sorted(position[e] for e, base in enumerate(is_base) if base)
+    result = {}
+    for entry, approved_id in sorted(((e, a) for e, a in enumerate(approved_ids) if a is not None),
+                                     key=lambda t: t[1]):
+        pos = position[entry]
+        result[approved_id] = bisect.bisect_left(placed, pos)
+        bisect.insort(placed, pos)
+    return result
+
+
+@span('optimizer.reoptimize')
+def reoptimize_line(line_code: str, data_dir: str, metric: str = 'euclidean', fix_terminals: bool = True,
+                    time_budget_s: float = 2.0, max_iterations: int = 10000, dry_run: bool = False) -> dict:
+    """
+    Re-place every approved stop of a line with 2-opt / Or-opt over the whole
+    route. The shapefile stops are the line's own sequence and keep their
+    order; only approved stops move, so the result is stored as new
+    insert_after values, updated in one statement. Unless dry_run, the
+    materialized route is rebuilt; the caller commits.
+    """
+    base = get_existing_stops(line_code, data_dir)
+    approved = ApprovedStop.query.filter_by(line_code=line_code).order_by(ApprovedStop.id).all()
+
+    # Same replay as get_full_route, keeping track of which entry is which stop
+    entries = [(s['lat'], s['lon'], None) for s in base]
+    for s in approved:
+        idx = min(len(entries) if s.insert_after is None else s.insert_after, len(entries))
+        entries.insert(idx, (s.lat, s.lon, s))
+
+    report = {'line_code': line_code, 'approved': len(approved), 'updated': 0, 'dry_run': dry_run}
+    if not approved or len(entries) < 3:
+        report.update({'stops': len(entries), 'before_m': None, 'after_m': None, 'saved_m': 0.0,
+                       'iterations': 0, 'two_opt_moves': 0, 'or_opt_moves': 0, 'stopped': 'converged', 'seconds': 0.0})
+        return report
+
+    d = distance_matrix(np.array([e[0] for e in entries]), np.array([e[1] for e in entries]), metric, data_dir)
+    is_base = [e[2] is None for e in entries]
+    order, result = improve_route(d, locked=is_base, fix_terminals=fix_terminals,
+                                  time_budget_s=time_budget_s, max_iterations=max_iterations)
+    report.update(result)
+
+    insert_after = replay_insert_after(order, is_base, [None if e[2] is None else e[2].id for e in entries])
+    changed = [{'id': s.id, 'insert_after': insert_after[s.id]} for s in approved
+               if insert_after[s.id] != s.insert_after]
+    report['updated'] = len(changed)
+    if changed and not dry_run:
+        db.session.execute(update(ApprovedStop), changed)
+        rebuild_route(line_code, data_dir)
+    return report
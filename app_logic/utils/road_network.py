@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+
+import numpy as np
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+from app_logic.utils.cache import LRUCache
+from app_logic.utils.geo import to_local_xy
+from app_logic.utils.geodata import DATA_DIR, get_layer, store
+
+
+GRAPH_FILE = 'road_graph.npz'
+SOURCE_LAYERS = ('roads',)
+
+SNAP_GRID_M = 1.0           # vertices closer than this become one node
+SSSP_CACHE_SIZE = 256       # single-source results kept per process
+LEG_CACHE_SIZE = 20000      # stop-to-stop leg distances kept per process
+LEG_LIMIT_MIN_M = 2000.0    # search radius for a leg between consecutive stops (or around a candidate) …
+LEG_LIMIT_FACTOR = 4.0      # … or this many times their straight-line distance (to the nearest stop)
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def build_graph(data_dir: str = DATA_DIR) -> dict:
+    """
+    Turn strade.shp into an undirected graph in CSR form.
+    Polyline vertices are snapped to a SNAP_GRID_M grid so touching roads share
+    nodes; edge weights are segment lengths in metres on the local projection.
+    Returns the flat arrays written to GRAPH_FILE.
+    """
+    roads = get_layer('roads', data_dir)
+    parts = shapely.get_parts(roads.geometry.values)
+    coords, part = shapely.get_coordinates(parts, return_index=True)
+    x, y = to_local_xy(coords[:, 1], coords[:, 0])
+
+    keys = np.round(np.column_stack([x, y]) / SNAP_GRID_M).astype(np.int64)
+    _, node = np.unique(keys, axis=0, return_inverse=True)
+    node = node.ravel()
+    n = int(node.max()) + 1 if len(node) else 0
+    counts = np.bincount(node, minlength=n)
+    node_x = np.bincount(node, weights=x, minlength=n) / np.maximum(counts, 1)
+    node_y = np.bincount(node, weights=y, minlength=n) / np.maximum(counts, 1)
+
+    same_part = part[1:] == part[:-1]
+    u, v = node[:-1][same_part], node[1:][same_part]
+    w = np.hypot(np.diff(x)[same_part], np.diff(y)[same_part])
+    keep = u != v
+    u, v, w = u[keep], v[keep], w[keep]
+
+    # Both directions, then keep the shortest of any parallel edges
+    u, v, w = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([w, w])
+    order = np.lexsort((w, v, u))
+    u, v, w = u[order], v[order], w[order]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    graph = csr_matrix((w[first], (u[first], v[first])), shape=(n, n))
+
+    _, component = connected_components(graph, directed=False)
+    main = component == np.argmax(np.bincount(component)) if n else np.zeros(0, dtype=bool)
+
+    return {
+        'node_x': node_x,
+        'node_y': node_y,
+        'indptr': graph.indptr.astype(np.int64),
+        'indices': graph.indices.astype(np.int64),
+        'weights': graph.data,
+        'main': main,
+        'source_hash': np.array(store.content_hash(SOURCE_LAYERS, data_dir)),
+    }
+
+
+def write_graph(arrays: dict, data_dir: str = DATA_DIR) -> str:
+    """Atomically write the graph cache next to the shapefiles."""
+    path = os.path.join(data_dir, GRAPH_FILE)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+# ── Queries ───────────────────────────────────────────────────────────────────
+
+class RoadNetwork:
+    """
+    Shortest-path distances (metres) over the road graph.
+    Points are snapped to the nearest node of the largest connected
+    component; the snap distance is added to every leg.
+    """
+
+    def __init__(self, arrays: dict):
+        self.source_hash = str(arrays['source_hash'])
+        n = len(arrays['node_x'])
+        self.graph = csr_matrix((arrays['weights'], arrays['indices'], arrays['indptr']), shape=(n, n))
+        self.node_x = arrays['node_x']
+        self.node_y = arrays['node_y']
+        self._snap_nodes = np.flatnonzero(arrays['main'])
+        self._tree = cKDTree(np.column_stack([self.node_x[self._snap_nodes], self.node_y[self._snap_nodes]]))
+        self._sssp = LRUCache(SSSP_CACHE_SIZE)
+        self._legs = LRUCache(LEG_CACHE_SIZE)
+
+    @property
+    def node_count(self) -> int:
+        return self.graph.shape[0]
+
+    def snap(self, lats, lons) -> tuple:
+        """Nearest graph node and snap distance for each point."""
+        x, y = to_local_xy(lats, lons)
+        dist, i = self._tree.query(np.column_stack([np.atleast_1d(x), np.atleast_1d(y)]))
+        return self._snap_nodes[i], dist
+
+    def distances_from(self, node: int) -> np.ndarray:
+        """Distance from node to every node (inf if unreachable). LRU-cached."""
+        def compute():
+            return dijkstra(self.graph, directed=True, indices=int(node)).astype(np.float32)
+        return self._sssp.get_or_compute(int(node), compute)
+
+    def distances_within(self, node: int, limit: float) -> np.ndarray:
+        """Distance from node to every node up to limit metres (inf beyond); reuses a cached full search."""
+        cached = self._sssp.get(int(node))
+        if cached is not None:
+            return cached
+        return dijkstra(self.graph, directed=True, indices=int(node), limit=limit)
+
+    def leg(self, a: int, b: int) -> float:
+        """Node-to-node distance, searched only as far as needed for short legs."""
+        a, b = int(a), int(b)
+        if a == b:
+            return 0.0
+        key = (a, b) if a < b else (b, a)
+
+        def compute():
+            cached = self._sssp.get(a)
+            if cached is not None:
+                return float(cached[b])
+            straight = float(np.hypot(self.node_x[a] - self.node_x[b], self.node_y[a] - self.node_y[b]))
+            limit = max(LEG_LIMIT_MIN_M, LEG_LIMIT_FACTOR * straight)
+            d = dijkstra(self.graph, directed=True, indices=a, limit=limit)[b]
+            return float(d) if np.isfinite(d) else float(self.distances_from(a)[b])
+        return self._legs.get_or_compute(key, compute)
+
+    def distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """Point-to-point network distance."""
+        nodes, snap = self.snap([lat1, lat2], [lon1, lon2])
+        return float(snap[0] + self.leg(nodes[0], nodes[1]) + snap[1])
+
+    def one_to_many(self, lat: float, lon: float, lats, lons) -> np.ndarray:
+        """Network distance from one point to many."""
+        (src,), (src_snap,) = self.snap([lat], [lon])
+        nodes, snap = self.snap(lats, lons)
+        return src_snap + self.distances_from(src)[nodes].astype(float) + snap
+
+    def insertion_costs(self, route_lats, route_lons, lats, lons) -> np.ndarray:
+        """
+        (candidates × edges) detour matrix for inserting each candidate on each
+        edge i → (i + 1) % n of a closed route:
+          d(i, p) + d(p, i+1) - d(i, i+1)
+        Each candidate's search first stops at LEG_LIMIT_FACTOR times the
+        straight-line distance to its nearest stop (at least LEG_LIMIT_MIN_M).
+        An end beyond radius r is at least r away, which bounds the detour of
+        the edges not reached; when that bound could still beat the best edge
+        found, the search is widened until it cannot, so the minimum per
+        candidate is the same as with full searches.
+        """
+        stop_nodes, stop_snap = self.snap(route_lats, route_lons)
+        next_nodes = np.roll(stop_nodes, -1)
+        next_snap = np.roll(stop_snap, -1)
+        node_legs = np.array([self.leg(a, b) for a, b in zip(stop_nodes, next_nodes)])
+        legs = node_legs + stop_snap + next_snap
+
+        cand_nodes, cand_snap = self.snap(lats, lons)
+        nearest = np.hypot(self.node_x[cand_nodes][:, None] - self.node_x[stop_nodes][None, :],
+                           self.node_y[cand_nodes][:, None] - self.node_y[stop_nodes][None, :]).min(axis=1)
+        limits = np.maximum(LEG_LIMIT_MIN_M, LEG_LIMIT_FACTOR * nearest)
+        costs = np.empty((len(cand_nodes), len(stop_nodes)))
+        for k, (node, snap, limit) in enumerate(zip(cand_nodes, cand_snap, limits)):
+            while True:
+                d = self.distances_from(node) if np.isinf(limit) else self.distances_within(node, limit)
+                d_stop, d_next = d[stop_nodes].astype(float), d[next_nodes].astype(float)
+                costs[k] = d_stop + stop_snap + d_next + next_snap + 2 * snap - legs
+                unreached = ~np.isfinite(costs[k])
+                if not unreached.any() or np.isinf(limit):
+                    break
+                # Node-to-node detour of an unreached edge, counting each unreached end at the radius
+                target = costs[k].min() - 2 * snap + node_legs[unreached]
+                known = np.where(np.isfinite(d_stop), d_stop, 0)[unreached] + np.where(np.isfinite(d_next), d_next, 0)[unreached]
+                ends = (~np.isfinite(d_stop[unreached])).astype(int) + (~np.isfinite(d_next[unreached]))
+                needed = (target - known) / ends
+                if (needed <= limit).all():
+                    break
+                limit = needed.max()
+        return costs
+
+    def stats(self) -> dict:
+        return {
+            'nodes': self.node_count,
+            'edges': self.graph.nnz // 2,
+            'sssp_cache': self._sssp.stats(),
+            'leg_cache': self._legs.stats(),
+        }
+
+
+_networks = {}   # data_dir → RoadNetwork
+_lock = threading.Lock()
+
+
+def _read_graph(path: str):
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            return {k: f[k] for k in f.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_network(data_dir: str = DATA_DIR) -> RoadNetwork:
+    """
+    Return the road network for data_dir, loading the on-disk graph cache or
+    rebuilding it when strade.shp no longer matches the stored hash.
+    """
+    key = os.path.abspath(data_dir)
+    current = store.content_hash(SOURCE_LAYERS, data_dir)
+    network = _networks.get(key)
+    if network is not None and network.source_hash == current:
+        return network
+
+    with _lock:
+        network = _networks.get(key)
+        if network is not None and network.source_hash == current:
+            return network
+
+        arrays = _read_graph(os.path.join(data_dir, GRAPH_FILE))
+        if arrays is None or str(arrays['source_hash']) != current:
+            t0 = time.perf_counter()
+            arrays = build_graph(data_dir)
+            print(f"road_network: rebuilt graph ({len(arrays['node_x'])} nodes) in {time.perf_counter() - t0:.2f}s")
+            try:
+                write_graph(arrays, data_dir)
+            except OSError as e:
+                print(f"road_network: could not write graph cache: {e}")
+
+        network = RoadNetwork(arrays)
+        _networks[key] = network
+        return network
@@ -0,0 +1,80 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+
+# Kept out of create_app on purpose: each loads on the first request that needs it
+LAZY_COMPONENTS = (
+    ('map (folium)', 'app_logic.utils.map_utils'),
+    ('tiles', 'app_logic.utils.tiles'),
+    ('nearest lines', 'app_logic.utils.nearest_lines'),
+    ('road network (scipy.sparse)', 'app_logic.utils.road_network'),
+    ('KD-trees (scipy.spatial)', 'scipy.spatial'),
+    ('geopandas', 'geopandas'),
+)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+
+class StartupReport:
+    """Wall time of each create_app step; kept in app.extensions['startup']."""
+
+    def __init__(self):
+        self.phases = []   # (name, seconds)
+
+    def add(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def as_dict(self) -> dict:
+        return {
+            'phases': [{'name': n, 'ms': round(s * 1000, 1)} for n, s in self.phases],
+            'total_ms': round(sum(s for n, s in self.phases if not n.startswith('lazy:')) * 1000, 1),
+        }
+
+    def format(self) -> str:
+        rows = [f"  {n:<40} {s * 1000:8.1f} ms" for n, s in self.phases]
+        return '\n'.join(['startup:'] + rows + [f"  {'total (excluding lazy)':<40} {self.as_dict()['total_ms']:8.1f} ms"])
+
+
+def measure_lazy(report: StartupReport):
+    """Import every LAZY_COMPONENTS module, timing each on top of what is already loaded."""
+    for name, module in LAZY_COMPONENTS:
+        with report.phase(f'lazy: {name}'):
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                print(f"startup: {module} unavailable ({e})")
+
+
+_CHILD = """
+import time
+t0 = time.perf_counter()
+import app_logic
+imported = time.perf_counter() - t0
+from app_logic.utils.startup import measure_lazy
+app = app_logic.create_app()
+report = app.extensions['startup']
+report.phases.insert(0, ('import app_logic', imported))
+{lazy}
+import json
+print(json.dumps(report.as_dict()))
+"""
+
+
+def cold_start(lazy: bool = True) -> dict:
+    """create_app in a fresh interpreter, so nothing is already imported. Returns StartupReport.as_dict()."""
+    code = _CHILD.format(lazy='measure_lazy(report)' if lazy else '')
+    out = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
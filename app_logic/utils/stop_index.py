@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+
+import numpy as np
+import shapely
+
+from app_logic.utils.geodata import DATA_DIR, get_layer, store
+
+
+INDEX_FILE = 'stop_index.npz'
+SOURCE_LAYERS = ('stops', 'lines')
+
+
+def source_hash(data_dir: str = DATA_DIR) -> str:
+    """SHA-1 of the stop and line shapefiles the index is built from."""
+    return store.content_hash(SOURCE_LAYERS, data_dir)
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def line_inputs(data_dir: str = DATA_DIR, line_codes=None) -> list:
+    """
+    (code, line parts, stop points, stop names) for every codLinea with
+    stops, or only those in line_codes, sorted by code. Plain shapely and
+    numpy arrays, so they can be handed to worker processes.
+    """
+    stops = get_layer('stops', data_dir)
+    lines = get_layer('lines', data_dir)
+
+    wanted = None if line_codes is None else set(line_codes)
+    parts = {code: geoms.values for code, geoms in lines.groupby('codLinea').geometry}
+    if 'nomeFermat' in stops:
+        all_names = stops['nomeFermat'].to_numpy(dtype=str)
+    else:
+        all_names = np.full(len(stops), 'Fermata')
+
+    return [
+        (str(code), parts.get(code), stops.geometry.values[idx], all_names[idx])
+        for code, idx in sorted(stops.groupby('codLinea').indices.items())
+        if wanted is None or str(code) in wanted
+    ]
+
+
+def order_line(code: str, parts, pts, names) -> dict:
+    """Merge one line's parts and order its stops along the result."""
+    geom = shapely.union_all(parts) if parts is not None else None
+    if geom is None or geom.is_empty:
+        # No line geometry: keep shapefile order
+        d = np.full(len(pts), np.nan)
+        order = np.arange(len(pts))
+    else:
+        d = shapely.line_locate_point(geom, pts)
+        order = np.argsort(d, kind='stable')
+    return {
+        'code': code,
+        'lat': shapely.get_y(pts)[order],
+        'lon': shapely.get_x(pts)[order],
+        'dist': d[order],
+        'names': names[order],
+    }
+
+
+def assemble_index(lines: list, source: str) -> dict:
+    """
+    Flat arrays written to INDEX_FILE from order_line results:
+      line_codes, offsets (stops of line i are offsets[i]:offsets[i+1]),
+      lat, lon, dist, names, source_hash
+    """
+    lines = sorted(lines, key=lambda r: r['code'])
+    offsets = np.cumsum([0] + [len(r['lat']) for r in lines])
+    return {
+        'line_codes': np.array([r['code'] for r in lines], dtype=str),
+        'offsets': offsets.astype(np.int64),
+        'lat': np.concatenate([r['lat'] for r in lines]) if lines else np.empty(0),
+        'lon': np.concatenate([r['lon'] for r in lines]) if lines else np.empty(0),
+        'dist': np.concatenate([r['dist'] for r in lines]) if lines else np.empty(0),
+        'names': np.concatenate([r['names'] for r in lines]) if lines else np.empty(0, dtype=str),
+        'source_hash': np.array(source),
+    }
+
+
+def split_index(arrays: dict) -> list:
+    """The inverse of assemble_index: one order_line-style dict per line."""
+    offsets = arrays['offsets']
+    return [
+        {key: arrays[key][offsets[i]:offsets[i + 1]] for key in ('lat', 'lon', 'dist', 'names')} | {'code': str(code)}
+        for i, code in enumerate(arrays['line_codes'])
+    ]
+
+
+def build_index(data_dir: str = DATA_DIR) -> dict:
+    """Order every line's stops along its merged geometry (see assemble_index for the arrays)."""
+    return assemble_index([order_line(*args) for args in line_inputs(data_dir)], source_hash(data_dir))
+
+
+def write_index(arrays: dict, data_dir: str = DATA_DIR) -> str:
+    """Atomically write the index next to the shapefiles."""
+    path = os.path.join(data_dir, INDEX_FILE)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+# ── Runtime loader ────────────────────────────────────────────────────────────
+
+class StopIndex:
+    """In-memory view of the index: O(stops of the line) lookups by codLinea."""
+
+    def __init__(self, arrays: dict):
+        self.source_hash = str(arrays['source_hash'])
+        self.lat = arrays['lat']
+        self.lon = arrays['lon']
+        self.dist = arrays['dist']
+        self.names = arrays['names']
+        offsets = arrays['offsets']
+        self._ranges = {
+            str(code): (int(offsets[i]), int(offsets[i + 1]))
+            for i, code in enumerate(arrays['line_codes'])
+        }
+
+    def line_codes(self) -> list:
+        return sorted(self._ranges)
+
+    def has_line(self, line_code: str) -> bool:
+        return line_code in self._ranges
+
+    def stops(self, line_code: str) -> list:
+        start, end = self._ranges.get(line_code, (0, 0))
+        return [
+            {
+                'lat': float(self.lat[i]),
+                'lon': float(self.lon[i]),
+                'name': str(self.names[i]),
+                'is_new': False,
+                'is_approved': False,
+            }
+            for i in range(start, end)
+        ]
+
+
+_indexes = {}   # data_dir → StopIndex
+_lock = threading.Lock()
+
+
+def read_index(data_dir: str = DATA_DIR):
+    """The arrays stored in INDEX_FILE, or None if there is no readable index."""
+    return _read_index(os.path.join(data_dir, INDEX_FILE))
+
+
+def forget_index(data_dir: str = DATA_DIR):
+    """Drop the in-memory index so the next get_index() reads the file again."""
+    with _lock:
+        _indexes.pop(os.path.abspath(data_dir), None)
+
+
+def _read_index(path: str):
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            return {k: f[k] for k in f.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_index(data_dir: str = DATA_DIR) -> StopIndex:
+    """
+    Return the stop index for data_dir, loading it from disk or rebuilding it
+    when the source shapefiles no longer match the stored hash.
+    """
+    key = os.path.abspath(data_dir)
+    current = source_hash(data_dir)
+    index = _indexes.get(key)
+    if index is not None and index.source_hash == current:
+        return index
+
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None and index.source_hash == current:
+            return index
+
+        arrays = _read_index(os.path.join(data_dir, INDEX_FILE))
+        if arrays is None or str(arrays['source_hash']) != current:
+            t0 = time.perf_counter()
+            arrays = build_index(data_dir)
+            print(f"stop_index: rebuilt {len(arrays['line_codes'])} lines in {time.perf_counter() - t0:.2f}s")
+            try:
+                write_index(arrays, data_dir)
+            except OSError as e:
+                # Read-only deployments keep the index in memory only
+                print(f"stop_index: could not write index: {e}")
+
+        index = StopIndex(arrays)
+        _indexes[key] = index
+        return index
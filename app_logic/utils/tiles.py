@@ -0,0 +1,97 @@
+import json
+import math
+
+import numpy as np
+import shapely
+
+from app_logic.utils.cache import LRUCache
+from app_logic.utils.flatgeo import FLAT_LAYERS, get_flat
+from app_logic.utils.geodata import DATA_DIR, LAYER_FILES, get_layer, store
+from app_logic.utils.pyramid import TILE_PROPERTIES, get_pyramid, tolerance_for_zoom
+
+
+# Below these zooms a layer is too dense to be useful and tiles come back empty
+MIN_ZOOM = {'lines': 0, 'stops': 12, 'roads': 12, 'buildings': 15}
+MAX_ZOOM = 20
+
+_tile_cache = LRUCache(512)
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """(west, south, east, north) in degrees of a Web Mercator XYZ tile."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def _features_json(ids, geoms, records, layer: str, tolerance: float) -> str:
+    if tolerance > 0 and layer != 'stops':
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    geojson = shapely.to_geojson(geoms)
+
+    features = []
+    for fid, geom, rec in zip(ids, geojson, records):
+        if geom is None:
+            continue
+        features.append('{"type":"Feature","id":%d,"properties":%s,"geometry":%s}'
+                        % (fid, json.dumps(rec, default=str), geom))
+    return '{"type":"FeatureCollection","features":[' + ','.join(features) + ']}'
+
+
+def _flat_features(flat, layer: str, bbox, lines) -> tuple:
+    hits = np.sort(flat.sindex().query(shapely.box(*bbox)))
+    if lines:
+        hits = hits[np.isin(flat.column('codLinea')[hits], lines)]
+    props = [c for c in TILE_PROPERTIES[layer] if c in flat.columns]
+    values = {c: flat.column(c)[hits].tolist() for c in props}
+    records = [{c: values[c][i] for c in props} for i in range(len(hits))]
+    return hits.tolist(), flat.geometries()[hits], records
+
+
+def _gdf_features(layer: str, bbox, lines, data_dir: str) -> tuple:
+    gdf = get_layer(layer, data_dir)
+    hits = np.sort(store.sindex(layer, data_dir).query(shapely.box(*bbox)))
+    subset = gdf.iloc[hits]
+    if lines:
+        subset = subset[subset['codLinea'].isin(lines)]
+    props = [c for c in TILE_PROPERTIES[layer] if c in subset.columns]
+    records = (subset[props].astype(object).where(subset[props].notna(), None).to_dict('records')
+               if props else [{}] * len(subset))
+    return subset.index, subset.geometry.values, records
+
+
+def render_tile(layer: str, z: int, x: int, y: int, data_dir: str = DATA_DIR, lines=None) -> str:
+    """
+    GeoJSON FeatureCollection of the layer's features intersecting tile z/x/y,
+    simplified for the zoom level. Read from the precomputed pyramid when
+    there is one, else from the memory-mapped flat arrays or the shapefile.
+    Features keep their row index as id so the client can skip ones already
+    drawn from a neighbouring tile.
+    Results are cached per tile, line filter and layer file signature.
+    """
+    if layer not in LAYER_FILES:
+        raise KeyError(layer)
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError('tile out of range')
+
+    lines = tuple(sorted(lines)) if lines and layer in ('lines', 'stops') else ()
+    key = (layer, z, x, y, lines, store.signature(layer, data_dir), data_dir)
+
+    def compute():
+        if z < MIN_ZOOM[layer]:
+            return '{"type":"FeatureCollection","features":[]}'
+        pyramid = get_pyramid(layer, data_dir)
+        if pyramid is not None:
+            return pyramid.feature_collection(z, tile_bounds(z, x, y))
+        bbox = tile_bounds(z, x, y)
+        flat = get_flat(layer, data_dir) if layer in FLAT_LAYERS else None
+        if flat is not None:
+            ids, geoms, records = _flat_features(flat, layer, bbox, lines)
+        else:
+            ids, geoms, records = _gdf_features(layer, bbox, lines, data_dir)
+        return _features_json(ids, geoms, records, layer, tolerance_for_zoom(z))
+
+    return _tile_cache.get_or_compute(key, compute)
@@ -0,0 +1,110 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app_logic import db
+from app_logic.utils import stop_index
+from app_logic.utils.geodata import DATA_DIR, get_layer
+from app_logic.utils.live_routes import rebuild_route
+
+
+def _order_line_timed(code, parts, pts, names) -> dict:
+    t0 = time.perf_counter()
+    result = stop_index.order_line(code, parts, pts, names)
+    result['seconds'] = time.perf_counter() - t0
+    return result
+
+
+def order_lines(inputs: list, workers: int = None) -> tuple:
+    """
+    Run stop_index.order_line for every line_inputs entry, across worker
+    processes unless workers is 1. Returns ({code: result}, {code: error}).
+    """
+    results, failures = {}, {}
+    if workers == 1 or len(inputs) < 2:
+        for args in inputs:
+            try:
+                results[args[0]] = _order_line_timed(*args)
+            except Exception as e:
+                failures[args[0]] = repr(e)
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_order_line_timed, *args): args[0] for args in inputs}
+        for future in as_completed(futures):
+            code = futures[future]
+            try:
+                results[code] = future.result()
+            except Exception as e:
+                failures[code] = repr(e)
+    return results, failures
+
+
+def warmup(data_dir: str = DATA_DIR, line_codes: list = None, workers: int = None, routes: bool = True) -> dict:
+    """
+    Precompute what the first visitor of a line would otherwise pay for:
+    each line's merged geometry and ordered stops (in parallel, written to
+    the stop index) and its materialized live route (LineRoute, committed
+    line by line so one failure does not undo the others).
+
+    With line_codes only those lines are recomputed and merged into the
+    existing index; if the index is missing or built from other shapefiles
+    every line is reordered, since the index is stored as a whole.
+    Returns a report with per-line timings and failures.
+    """
+    t0 = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    current = stop_index.source_hash(data_dir)
+    existing = stop_index.read_index(data_dir)
+    fresh = existing is not None and str(existing['source_hash']) == current
+    partial = line_codes is not None and fresh
+
+    all_codes = sorted(set(get_layer('lines', data_dir)['codLinea'].astype(str)))
+    inputs = stop_index.line_inputs(data_dir, line_codes if partial else None)
+    with_stops = {args[0] for args in inputs}
+
+    t = time.perf_counter()
+    ordered, failures = order_lines(inputs, workers)
+    order_seconds = time.perf_counter() - t
+
+    lines = {code: {'stops': len(r['lat']), 'order_ms': round(r['seconds'] * 1000, 2)} for code, r in ordered.items()}
+
+    # A full rebuild with failed lines would drop them from the index: keep the old file instead
+    index_written = False
+    if not failures or partial:
+        merged = {r['code']: r for r in stop_index.split_index(existing)} if partial else {}
+        merged.update(ordered)
+        stop_index.write_index(stop_index.assemble_index(list(merged.values()), current), data_dir)
+        stop_index.forget_index(data_dir)
+        index_written = True
+
+    t = time.perf_counter()
+    if routes and index_written:
+        targets = [c for c in (line_codes or sorted(with_stops)) if c in ordered]
+        for code in targets:
+            t_line = time.perf_counter()
+            try:
+                rebuild_route(code, data_dir)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                failures[code] = repr(e)
+                continue
+            lines[code]['route_ms'] = round((time.perf_counter() - t_line) * 1000, 2)
+    route_seconds = time.perf_counter() - t
+
+    for code in line_codes or []:
+        if code not in with_stops and code not in all_codes:
+            failures[code] = 'codLinea sconosciuto'
+
+    return {
+        'workers': workers,
+        'partial': partial,
+        'index_written': index_written,
+        'lines': lines,
+        'without_stops': sorted(set(all_codes) - with_stops) if not partial else [],
+        'failures': failures,
+        'order_seconds': round(order_seconds, 3),
+        'route_seconds': round(route_seconds, 3),
+        'seconds': round(time.perf_counter() - t0, 3),
+    }
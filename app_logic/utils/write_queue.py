@@ -0,0 +1,65 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app_logic import db
+from app_logic.utils.ingest import insert_rows
+
+
+class WriteQueue:
+    """
+    Group commit for citizen requests. submit() hands a validated row to a
+    writer thread and blocks until the transaction holding it has committed,
+    so the id it returns is durable. The writer takes everything queued,
+    up to batch_size rows, waiting at most flush_ms for more to arrive, and
+    writes it with one statement and one commit.
+    """
+
+    def __init__(self, app, batch_size: int = 200, flush_ms: int = 5, max_queued: int = 10000):
+        self._app = app
+        self._queue = queue.Queue(maxsize=max_queued)
+        self.batch_size = batch_size
+        self.flush_s = flush_ms / 1000.0
+        self.batches = 0
+        self.rows = 0
+        self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict, timeout: float = 10.0) -> int:
+        """Queue a row and return its id once committed. Raises queue.Full or TimeoutError when overloaded."""
+        future = Future()
+        self._queue.put((row, future), timeout=timeout)
+        return future.result(timeout=timeout)
+
+    def _take(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            with self._app.app_context():
+                try:
+                    ids = insert_rows([row for row, _ in batch])
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"write queue error: {e}")
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+            self.batches += 1
+            self.rows += len(batch)
+            for (_, future), row_id in zip(batch, ids):
+                future.set_result(row_id)
+
+    def stats(self) -> dict:
+        return {'queued': self._queue.qsize(), 'batches': self.batches, 'rows': self.rows}
@@ -0,0 +1 @@
+"""Benchmark suite for the optimizer, clustering, map rendering and Flask endpoints; run with python -m benchmarks."""
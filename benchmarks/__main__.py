@@ -0,0 +1,125 @@
+"""
+Run the benchmark suite and write the results as JSON.
+
+    python -m benchmarks                                  # default sizes, 3 sampled lines
+    python -m benchmarks --sizes 10,1000,100000 --lines all
+    python -m benchmarks --out after.json --baseline before.json --threshold 1.25
+
+Endpoints run against a throwaway SQLite database, never instance/tper.db.
+Exit status is 1 when --baseline is given and a p50 regressed past --threshold.
+"""
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def _parse_args(argv):
+    p = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n\n')[0])
+    p.add_argument('--sizes', default='10,100,1000,10000',
+                   help='requests per line, comma separated (up to 100000)')
+    p.add_argument('--lines', default='3', help="number of sampled codLinea, or 'all'")
+    p.add_argument('--repeat', type=int, default=20, help='timed calls per case (scaled down for big sizes)')
+    p.add_argument('--only', default='', help='comma separated case names to run (e.g. cluster_requests,endpoints)')
+    p.add_argument('--no-endpoints', action='store_true', help='skip the Flask endpoint cases')
+    p.add_argument('--out', default=None, help='results file (default benchmarks/results/<timestamp>.json)')
+    p.add_argument('--baseline', default=None, help='results file to compare against')
+    p.add_argument('--threshold', type=float, default=1.25, help='p50 ratio above which a case counts as regressed')
+    return p.parse_args(argv)
+
+
+def _print_result(r):
+    label = f"{r['name']:<36} size={str(r.get('size')):>7} line={str(r.get('line')):<8}"
+    mem = f" peak={r['peak_kb']:>10.1f} KB" if 'peak_kb' in r else ''
+    print(f"{label} p50={r['p50_ms']:>10.3f} p90={r['p90_ms']:>10.3f} p99={r['p99_ms']:>10.3f} ms{mem}", flush=True)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    sizes = sorted(int(s) for s in args.sizes.split(',') if s)
+    only = {s for s in args.only.split(',') if s}
+
+    # Must be set before app_logic (and config) are imported
+    tmp_dir = tempfile.mkdtemp(prefix='tper-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    os.environ.setdefault('INGEST_MODE', 'direct')
+
+    from app_logic.utils.geodata import DATA_DIR
+    from benchmarks import cases, synthetic, timing
+
+    lines = synthetic.line_codes(DATA_DIR, None if args.lines == 'all' else int(args.lines))
+    print(f"benchmarks: {len(lines)} lines, sizes {sizes}, db {os.environ['DATABASE_URL']}")
+
+    results = []
+    started = time.perf_counter()
+    for case in cases.LIBRARY_CASES:
+        name = case.__name__.replace('bench_', '')
+        if only and name not in only:
+            continue
+        for r in case(lines, sizes, DATA_DIR, args.repeat):
+            _print_result(r)
+            results.append(r)
+
+    if not args.no_endpoints and (not only or 'endpoints' in only):
+        from app_logic import create_app, init_schema
+        app = create_app()
+        with app.app_context():
+            init_schema()
+        seeded = 0
+        # Sizes are ascending, so each step only tops the database up
+        for size in sizes:
+            cases.seed_database(app, lines, size - seeded, DATA_DIR)
+            seeded = size
+            for r in cases.bench_endpoints(app, lines, size, DATA_DIR, args.repeat):
+                _print_result(r)
+                results.append(r)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+            'lines': lines,
+            'repeat': args.repeat,
+            'seconds': round(time.perf_counter() - started, 1),
+        },
+        'results': results,
+    }
+
+    out = args.out
+    if out is None:
+        results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        out = os.path.join(results_dir, datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json')
+    timing.save(report, out)
+    print(f"benchmarks: results written to {out}")
+
+    if args.baseline:
+        rows = timing.compare(report, timing.load(args.baseline), args.threshold)
+        regressed = [r for r in rows if r['regressed']]
+        for r in rows:
+            flag = '  REGRESSED' if r['regressed'] else ''
+            print(f"{r['name']:<36} size={str(r['size']):>7} line={str(r['line']):<8} "
+                  f"{r['baseline_p50_ms']:>10.3f} → {r['p50_ms']:>10.3f} ms  x{r['ratio']:.2f}{flag}")
+        print(f"benchmarks: {len(rows)} compared, {len(regressed)} regressed (threshold x{args.threshold})")
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
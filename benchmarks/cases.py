@@ -0,0 +1,159 @@
+"""
+The benchmarked functions and endpoints. Each case yields result dicts
+{name, size, line, ...measure() fields}; sizes are requests per line.
+"""
+import itertools
+
+from benchmarks import synthetic
+from benchmarks.timing import measure
+
+
+def _repeat(size: int, base: int) -> int:
+    # Fewer samples for the big inputs so a full run stays in minutes
+    if size >= 100000:
+        return max(3, base // 10)
+    if size >= 10000:
+        return max(5, base // 4)
+    return base
+
+
+# ── Library functions ─────────────────────────────────────────────────────────
+
+def bench_get_existing_stops(lines, sizes, data_dir, repeat):
+    from app_logic.utils.optimizer import get_existing_stops
+
+    for line in lines:
+        yield {'name': 'get_existing_stops', 'size': None, 'line': line,
+               **measure(lambda: get_existing_stops(line, data_dir), repeat)}
+
+
+def bench_get_full_route(lines, sizes, data_dir, repeat):
+    from app_logic.utils.optimizer import get_full_route
+
+    for line in lines:
+        # Approved stops stay a small fraction of the requests, as they do in practice
+        for size in sizes:
+            approved = synthetic.approved_objects(line, max(1, size // 100), data_dir)
+            yield {'name': 'get_full_route', 'size': size, 'line': line,
+                   **measure(lambda: get_full_route(line, data_dir, approved), _repeat(size, repeat))}
+
+
+def bench_cluster_requests(lines, sizes, data_dir, repeat):
+    from app_logic.utils.clustering import cluster_requests
+
+    for line in lines:
+        for size in sizes:
+            requests = synthetic.request_objects(line, size, data_dir)
+            yield {'name': 'cluster_requests', 'size': size, 'line': line,
+                   **measure(lambda: cluster_requests(requests), _repeat(size, repeat))}
+
+
+def bench_optimize_route(lines, sizes, data_dir, repeat):
+    from app_logic.utils.optimizer import get_full_route, optimize_route
+
+    for line in lines:
+        for size in sizes:
+            approved = synthetic.approved_objects(line, max(1, size // 100), data_dir)
+            base = get_full_route(line, data_dir, approved)
+            lat, lon = synthetic.points_near_line(line, 1, data_dir, seed=size)
+            yield {'name': 'optimize_route', 'size': size, 'line': line,
+                   **measure(lambda: optimize_route(line, float(lat[0]), float(lon[0]), data_dir, base=base),
+                             _repeat(size, repeat))}
+
+
+def bench_rank_insertions(lines, sizes, data_dir, repeat):
+    from app_logic.utils.optimizer import get_full_route, rank_insertions
+
+    for line in lines:
+        base = get_full_route(line, data_dir, [])
+        for size in sizes:
+            lat, lon = synthetic.points_near_line(line, size, data_dir)
+            points = list(zip(lat.tolist(), lon.tolist()))
+            yield {'name': 'rank_insertions', 'size': size, 'line': line,
+                   **measure(lambda: rank_insertions(line, points, data_dir, base=base), _repeat(size, repeat))}
+
+
+def bench_create_map(lines, sizes, data_dir, repeat):
+    from app_logic.utils.map_utils import create_map
+
+    # Whole-city render plus one render per sampled line; folium is slow, so few samples
+    for selected in [[]] + [[line] for line in lines[:3]]:
+        yield {'name': 'create_map', 'size': None, 'line': ','.join(selected) or None,
+               **measure(lambda: create_map(['lines', 'stops'], selected).get_root().render(),
+                         max(2, repeat // 10), memory=False)}
+
+
+LIBRARY_CASES = (
+    bench_get_existing_stops,
+    bench_get_full_route,
+    bench_cluster_requests,
+    bench_optimize_route,
+    bench_rank_insertions,
+    bench_create_map,
+)
+
+
+# ── Flask endpoints ───────────────────────────────────────────────────────────
+
+CITY_BBOX = '11.20,44.42,11.48,44.56'   # w,s,e,n around Bologna
+
+
+def seed_database(app, lines, size, data_dir):
+    """Fill the (temporary) database with size pending requests per line, clustered at ingest."""
+    from app_logic import db
+    from app_logic.utils.ingest import insert_rows
+
+    with app.app_context():
+        for i, line in enumerate(lines):
+            rows = synthetic.request_rows(line, size, data_dir, seed=i)
+            for start in range(0, len(rows), 5000):
+                insert_rows(rows[start:start + 5000])
+                db.session.commit()
+
+
+def bench_endpoints(app, lines, size, data_dir, repeat):
+    """Main public and admin endpoints through the test client, against a database seeded with size requests per line."""
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['is_admin'] = True
+
+    def get(url):
+        def call():
+            r = client.get(url)
+            assert r.status_code in (200, 304), f'{url} → {r.status_code}'
+            return r.data
+        return call
+
+    def post(url, payload):
+        def call():
+            r = client.post(url, json=payload)
+            assert r.status_code == 200, f'{url} → {r.status_code}'
+        return call
+
+    line = lines[0]
+    lat, lon = synthetic.points_near_line(line, 100, data_dir, seed=99)
+    points = [[float(a), float(b)] for a, b in zip(lat, lon)]
+
+    spread = itertools.cycle(points[1:])
+
+    def post_spread():
+        lat_, lon_ = next(spread)
+        post('/request-stop', {'line_code': line, 'lat': lat_, 'lon': lon_, 'note': 'benchmark'})()
+
+    cases = [
+        ('GET /', get('/'), max(2, repeat // 4)),
+        ('GET /api/route/<line>', get(f'/api/route/{line}'), repeat),
+        ('GET /api/nearest-lines', get(f'/api/nearest-lines?lat={lat[0]}&lon={lon[0]}'), repeat),
+        ('POST /api/nearest-lines (100 pts)', post('/api/nearest-lines', {'points': points}), repeat),
+        ('GET /api/pending-heatmap (city, binned)', get(f'/api/pending-heatmap?bbox={CITY_BBOX}&zoom=12'), repeat),
+        ('GET /api/pending-heatmap (points)', get(f'/api/pending-heatmap?bbox={CITY_BBOX}&zoom=17&line={line}'),
+         max(3, repeat // 4)),
+        ('GET /admin/dashboard', get('/admin/dashboard'), max(3, repeat // 4)),
+        ('GET /admin/api/clusters/<line>', get(f'/admin/api/clusters/{line}'), max(3, repeat // 4)),
+        ('POST /request-stop', post_spread, repeat),
+        # Same point every time: after the first call each submission is folded into the same row
+        ('POST /request-stop (repeat)', post('/request-stop', {'line_code': line, 'lat': points[0][0],
+                                                               'lon': points[0][1], 'note': 'benchmark'}), repeat),
+    ]
+    for name, fn, n in cases:
+        yield {'name': name, 'size': size, 'line': line, **measure(fn, n, memory=False)}
@@ -0,0 +1,75 @@
+"""Synthetic stop requests and approvals placed around the real stops of each line."""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from app_logic.utils.stop_index import get_index
+
+
+SPREAD_DEG = 0.0015   # ~150 m standard deviation around the anchor stop
+
+NOTES = ('vicino alla scuola', 'davanti al supermercato', 'fermata per l\'ospedale', '', '', '')
+
+
+def line_codes(data_dir: str, limit: int = None, seed: int = 0) -> list:
+    """Every codLinea with stops in the index, or a reproducible sample of `limit` of them."""
+    codes = get_index(data_dir).line_codes()
+    if limit is None or limit >= len(codes):
+        return codes
+    rng = np.random.default_rng(seed)
+    return sorted(rng.choice(codes, size=limit, replace=False).tolist())
+
+
+def points_near_line(line_code: str, n: int, data_dir: str, seed: int = 0) -> tuple:
+    """n (lat, lon) points scattered around random stops of the line, as two arrays."""
+    stops = get_index(data_dir).stops(line_code)
+    rng = np.random.default_rng(seed)
+    if not stops:
+        return 44.4949 + rng.normal(0, 0.02, n), 11.3426 + rng.normal(0, 0.02, n)
+    anchor = rng.integers(0, len(stops), n)
+    lat = np.array([s['lat'] for s in stops])[anchor] + rng.normal(0, SPREAD_DEG, n)
+    lon = np.array([s['lon'] for s in stops])[anchor] + rng.normal(0, SPREAD_DEG, n)
+    return lat, lon
+
+
+def request_rows(line_code: str, n: int, data_dir: str, seed: int = 0) -> list:
+    """Rows in the shape ingest.insert_rows takes, pending and spread over the last 90 days."""
+    lat, lon = points_near_line(line_code, n, data_dir, seed)
+    rng = np.random.default_rng(seed + 1)
+    now = datetime.utcnow()
+    ages = rng.integers(0, 90 * 24 * 3600, n)
+    return [
+        {
+            'line_code': line_code,
+            'lat': float(lat[i]),
+            'lon': float(lon[i]),
+            'note': NOTES[i % len(NOTES)],
+            'preferred_days': 'lun,mar',
+            'preferred_time': '08:00',
+            'status': 'pending',
+            'created_at': now - timedelta(seconds=int(ages[i])),
+        }
+        for i in range(n)
+    ]
+
+
+def request_objects(line_code: str, n: int, data_dir: str, seed: int = 0) -> list:
+    """Stand-ins for StopRequest rows (id, line_code, lat, lon, note) without a database."""
+    lat, lon = points_near_line(line_code, n, data_dir, seed)
+    return [
+        SimpleNamespace(id=i + 1, line_code=line_code, lat=float(lat[i]), lon=float(lon[i]), note=NOTES[i % len(NOTES)])
+        for i in range(n)
+    ]
+
+
+def approved_objects(line_code: str, n: int, data_dir: str, seed: int = 0) -> list:
+    """Stand-ins for ApprovedStop rows with insert_after spread along the route."""
+    lat, lon = points_near_line(line_code, n, data_dir, seed)
+    n_stops = len(get_index(data_dir).stops(line_code))
+    rng = np.random.default_rng(seed + 2)
+    return [
+        SimpleNamespace(id=i + 1, line_code=line_code, lat=float(lat[i]), lon=float(lon[i]),
+                        insert_after=int(rng.integers(0, n_stops + i + 1)))
+        for i in range(n)
+    ]
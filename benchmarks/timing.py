@@ -0,0 +1,76 @@
+"""Latency percentiles, peak memory and baseline comparison."""
+import gc
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def measure(fn, repeat: int = 20, warmup: int = 1, memory: bool = True) -> dict:
+    """
+    Call fn warmup + repeat times and summarize the timed calls in
+    milliseconds. Peak memory comes from one extra call under tracemalloc,
+    kept apart so tracing does not inflate the latencies.
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+
+    result = {
+        'n': repeat,
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p90_ms': round(float(np.percentile(samples, 90)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'mean_ms': round(float(np.mean(samples)), 3),
+        'min_ms': round(float(np.min(samples)), 3),
+        'max_ms': round(float(np.max(samples)), 3),
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            result['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def key(result: dict) -> tuple:
+    return result['name'], result.get('size'), result.get('line')
+
+
+def compare(current: dict, baseline: dict, threshold: float = 1.25) -> list:
+    """
+    Match results on (name, size, line) and return one row per match with
+    the p50 ratio current / baseline; 'regressed' is set when the ratio
+    exceeds threshold.
+    """
+    base = {key(r): r for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        b = base.get(key(r))
+        if b is None or not b['p50_ms']:
+            continue
+        ratio = r['p50_ms'] / b['p50_ms']
+        rows.append({
+            'name': r['name'], 'size': r.get('size'), 'line': r.get('line'),
+            'baseline_p50_ms': b['p50_ms'], 'p50_ms': r['p50_ms'],
+            'ratio': round(ratio, 3), 'regressed': ratio > threshold,
+        })
+    return rows
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(report: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -8,4 +8,68 @@ class Config:
     
     SQLALCHEMY_DATABASE_URI = db_url
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool for server databases (SQLite keeps SQLAlchemy's defaults
+    # and gets WAL and busy_timeout pragmas on connect instead)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000)
+    if db_url.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800,
+        }
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'admin'
+
+    # Distance used to score stop insertions: 'euclidean' or 'network' (road graph from strade.shp)
+    ROUTE_METRIC = os.environ.get('ROUTE_METRIC') or 'euclidean'
+
+    # Rendered citizen map pages kept per worker, and browser/CDN max-age in seconds
+    MAP_CACHE_SIZE = int(os.environ.get('MAP_CACHE_SIZE') or 32)
+    MAP_CACHE_MAX_AGE = int(os.environ.get('MAP_CACHE_MAX_AGE') or 60)
+
+    # Layers the citizen map loads per tile from /api/tiles instead of inlining them
+    TILED_LAYERS = (os.environ.get('TILED_LAYERS') or 'roads,buildings').split(',')
+
+    # Background admin previews: pool size, how long /admin/preview waits before
+    # returning a job id to poll, and how many clusters the dashboard prefetches
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS') or 2)
+    PREVIEW_WAIT_MS = int(os.environ.get('PREVIEW_WAIT_MS') or 200)
+    PREVIEW_PREFETCH_LIMIT = int(os.environ.get('PREVIEW_PREFETCH_LIMIT') or 200)
+
+    # /request-stop writes: 'direct' commits each request, 'batched' queues them
+    # for a writer thread that group-commits up to INGEST_BATCH_SIZE rows,
+    # waiting at most INGEST_FLUSH_MS for a batch to fill
+    INGEST_MODE = os.environ.get('INGEST_MODE') or 'direct'
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE') or 200)
+    INGEST_FLUSH_MS = int(os.environ.get('INGEST_FLUSH_MS') or 5)
+
+    # Fold a /request-stop submission into a pending request of the same line
+    # within DEDUP_RADIUS_M metres and DEDUP_WINDOW_S seconds of its last submission
+    DEDUP_ENABLED = (os.environ.get('DEDUP_ENABLED') or '1') == '1'
+    DEDUP_RADIUS_M = float(os.environ.get('DEDUP_RADIUS_M') or 10)
+    DEDUP_WINDOW_S = int(os.environ.get('DEDUP_WINDOW_S') or 600)
+
+    # Create missing tables/columns/indexes on every boot. Off by default: run
+    # 'flask init-db' on deploy, so workers and CLI commands never alter the schema
+    AUTO_CREATE_SCHEMA = (os.environ.get('AUTO_CREATE_SCHEMA') or '0') == '1'
+
+    # Print the per-step create_app timings at boot ('flask startup-report' measures a cold process)
+    STARTUP_REPORT = (os.environ.get('STARTUP_REPORT') or '0') == '1'
+
+    # Whole-route re-optimization (2-opt / Or-opt): default time budget and move limit per line
+    REOPT_TIME_BUDGET_MS = int(os.environ.get('REOPT_TIME_BUDGET_MS') or 2000)
+    REOPT_MAX_ITERATIONS = int(os.environ.get('REOPT_MAX_ITERATIONS') or 10000)
+
+    # Request/stage/query histograms at /metrics. A TRACE_SAMPLE_RATE share of
+    # requests is traced into the log; admins (or clients sending
+    # "Authorization: Bearer METRICS_TOKEN") can force tracing with TRACE_HEADER: 1,
+    # get the spans in a Server-Timing header and read /metrics
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or '1') == '1'
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE') or 0.01)
+    TRACE_HEADER = os.environ.get('TRACE_HEADER') or 'X-Trace'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or ''
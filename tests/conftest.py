@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+import pytest
+
+# Config reads the environment at import: point it at a throwaway database first
+_tmp = tempfile.mkdtemp(prefix='tper-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+
+from app_logic import create_app, db, init_schema  # noqa: E402
+from app_logic.models import ApprovedStop, StopRequest  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    with app.app_context():
+        init_schema()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """Test client on emptied request and approval tables, with a fresh dedup grid."""
+    with app.app_context():
+        ApprovedStop.query.delete()
+        StopRequest.query.delete()
+        db.session.commit()
+    app.extensions.pop('recent_requests', None)
+    return app.test_client()
@@ -0,0 +1,13 @@
+from app_logic import db
+from app_logic.models import ApprovedStop
+
+
+def test_one_reoptimize_action_per_line(app, client):
+    with app.app_context():
+        db.session.add_all([ApprovedStop(line_code='27', lat=44.49 + i * 0.001, lon=11.34) for i in range(3)])
+        db.session.commit()
+    with client.session_transaction() as s:
+        s['is_admin'] = True
+
+    page = client.get('/admin/dashboard').get_data(as_text=True)
+    assert page.count("reoptimizeLine('27', this)") == 1
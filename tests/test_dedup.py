@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from app_logic import db
+from app_logic.models import StopRequest
+
+
+def _post_together(app, payloads):
+    """POST the payloads from one thread each, released at the same moment."""
+    barrier = threading.Barrier(len(payloads))
+    responses = [None] * len(payloads)
+
+    def post(i):
+        client = app.test_client()
+        barrier.wait()
+        responses[i] = client.post('/request-stop', json=payloads[i])
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(payloads))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return responses
+
+
+def test_repeat_is_folded(app, client):
+    payload = {'line_code': '27', 'lat': 44.501, 'lon': 11.341, 'note': 'scuola', 'preferred_days': 'lun'}
+    first = client.post('/request-stop', json=payload).get_json()
+    second = client.post('/request-stop', json={**payload, 'note': 'ospedale', 'preferred_days': 'mar'}).get_json()
+    assert second == {'ok': True, 'id': first['id'], 'merged': True}
+    with app.app_context():
+        req = db.session.get(StopRequest, first['id'])
+        assert (req.count, req.note, req.preferred_days) == (2, 'scuola | ospedale', 'lun,mar')
+
+
+@pytest.mark.parametrize('mode', ['direct', 'batched'])
+def test_simultaneous_pair_is_one_row(app, client, monkeypatch, mode):
+    monkeypatch.setitem(app.config, 'INGEST_MODE', mode)
+    for i in range(5):
+        payload = {'line_code': '27', 'lat': 44.49 + i * 0.001, 'lon': 11.33}
+        responses = _post_together(app, [payload, payload])
+        assert all(r.status_code == 200 for r in responses)
+        assert sorted(bool(r.get_json().get('merged')) for r in responses) == [False, True]
+
+    with app.app_context():
+        assert [r.count for r in StopRequest.query.all()] == [2] * 5
@@ -0,0 +1,32 @@
+from app_logic.utils.heatmap import binned_pending, cell_size
+
+
+def _cells(app, bbox, zoom, lines):
+    with app.app_context():
+        return binned_pending(bbox, zoom, lines)['cells']
+
+
+def test_cells_follow_the_tile_grid(app, client):
+    zoom, size = 12, cell_size(12)
+    # Just inside the upper edge of a cell: rounding instead of flooring would move it to the next one
+    lat, lon = 44.49 // size * size + 0.9 * size, 11.34 // size * size + 0.9 * size
+    client.post('/request-stop', json={'line_code': '14', 'lat': lat, 'lon': lon})
+
+    (cell,) = _cells(app, (11.2, 44.4, 11.5, 44.6), zoom, ['14'])
+    w, s, e, n = cell['bounds']
+    assert w <= lon < e and s <= lat < n
+
+
+def test_cells_and_points_weigh_repeat_submissions(app, client):
+    once = {'line_code': '15', 'lat': 44.4901, 'lon': 11.3401}
+    three_times = {'line_code': '15', 'lat': 44.4903, 'lon': 11.3403}
+    client.post('/request-stop', json=once)
+    for _ in range(3):
+        client.post('/request-stop', json=three_times)
+
+    (cell,) = _cells(app, (11.2, 44.4, 11.5, 44.6), 12, ['15'])
+    assert cell['count'] == 4
+    assert abs(cell['lat'] - 44.49025) < 1e-9 and abs(cell['lon'] - 11.34025) < 1e-9
+
+    points = client.get('/api/pending-heatmap?bbox=11.2,44.4,11.5,44.6&zoom=17&line=15').get_json()['points']
+    assert sorted(p['count'] for p in points) == [1, 3]
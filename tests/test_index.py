@@ -0,0 +1,5 @@
+def test_selected_lines_are_json_encoded_in_the_page(client):
+    r = client.get('/?bus_lines=27,a"b\\</script><b>')
+    assert r.status_code == 200
+    script = r.get_data(as_text=True)
+    assert 'const selectedLinesParam = ["27", "a\\"b\\\\\\u003c/script\\u003e\\u003cb\\u003e"].join' in script
@@ -0,0 +1,27 @@
+from app_logic.utils import jobs
+from app_logic.utils.jobs import PreviewJobs
+
+
+def test_failed_preview_is_reported_and_retried(monkeypatch):
+    calls = []
+
+    def flaky(line_code, lat, lon, data_dir, metric, base):
+        calls.append(line_code)
+        if len(calls) == 1:
+            raise RuntimeError('transient')
+        return base + [{'lat': lat, 'lon': lon}], len(base)
+
+    monkeypatch.setattr(jobs, 'optimize_route', flaky)
+    monkeypatch.setattr(jobs, 'score_points', lambda lat, lon, data_dir: [0.5])
+    pool = PreviewJobs(workers=1)
+    key = PreviewJobs.key('27', 1, 44.49, 11.34, 'euclidean')
+
+    _, job_id = pool.submit(key, [], 'data')
+    assert pool.wait(job_id, 5) is None
+    assert pool.status(job_id) == 'failed'
+
+    result, again = pool.submit(key, [], 'data')
+    assert result is None and again == job_id
+    assert pool.wait(job_id, 5)['insert_idx'] == 0
+    assert pool.status(job_id) == 'done'
+    assert len(calls) == 2
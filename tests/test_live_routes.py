@@ -0,0 +1,16 @@
+from app_logic import db
+from app_logic.models import LineRoute
+
+
+def test_unknown_line_is_not_materialized(app, client):
+    for i in range(3):
+        assert client.get(f'/api/route/bogus{i}').status_code == 404
+    with app.app_context():
+        assert LineRoute.query.filter(LineRoute.line_code.like('bogus%')).count() == 0
+
+
+def test_known_line_is_materialized(app, client):
+    r = client.get('/api/route/27')
+    assert r.status_code == 200 and r.get_json()['stops']
+    with app.app_context():
+        assert db.session.get(LineRoute, '27') is not None
@@ -0,0 +1,19 @@
+from app_logic.utils.metrics import REQUEST_SECONDS
+
+
+def test_unknown_methods_share_one_series(client):
+    for method in ('M0', 'M1', 'M2'):
+        client.open('/x', method=method)
+    methods = {labels[1] for labels in REQUEST_SECONDS._series}
+    assert not methods & {'M0', 'M1', 'M2'}
+    assert 'other' in methods
+
+
+def test_metrics_and_trace_override_need_admin(client):
+    assert client.get('/metrics').status_code == 403
+    assert 'Server-Timing' not in client.get('/api/route/27', headers={'X-Trace': '1'}).headers
+
+    with client.session_transaction() as s:
+        s['is_admin'] = True
+    assert client.get('/metrics').status_code == 200
+    assert 'Server-Timing' in client.get('/api/route/27', headers={'X-Trace': '1'}).headers
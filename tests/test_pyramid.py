@@ -0,0 +1,20 @@
+import numpy as np
+
+from app_logic.utils import pyramid
+from app_logic.utils.geodata import DATA_DIR, store
+
+
+def test_pyramid_built_after_a_miss_is_picked_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(pyramid, '_path', lambda layer, data_dir: str(tmp_path / f'{layer}.npz'))
+    monkeypatch.setattr(pyramid, '_pyramids', {})
+    assert pyramid.get_pyramid('roads') is None
+
+    # 'flask build-pyramid' while the server runs (an empty pyramid is enough here)
+    pyramid.write_pyramid('roads', {
+        'bounds': np.zeros((0, 4)),
+        'zooms': np.array([10], dtype=np.int64),
+        'source_hash': np.array(store.content_hash(('roads',), DATA_DIR)),
+        'z10_features': np.zeros(0, dtype=np.uint8),
+        'z10_offsets': np.zeros(1, dtype=np.int64),
+    })
+    assert pyramid.get_pyramid('roads') is not None
@@ -0,0 +1,18 @@
+from app_logic import db
+from app_logic.models import StopRequest
+
+
+def test_numeric_strings_are_accepted(app, client):
+    r = client.post('/request-stop', json={'line_code': '13', 'lat': '44.4970', 'lon': '11.34'})
+    assert r.status_code == 200
+    with app.app_context():
+        req = db.session.get(StopRequest, r.get_json()['id'])
+        assert (req.lat, req.lon) == (44.497, 11.34)
+
+
+def test_invalid_coordinates_are_rejected(app, client):
+    r = client.post('/request-stop', json={'line_code': '13', 'lat': 'abc', 'lon': '11.34'})
+    assert r.status_code == 400
+    assert r.get_json()['ok'] is False
+    with app.app_context():
+        assert StopRequest.query.count() == 0
@@ -0,0 +1,24 @@
+import numpy as np
+
+from app_logic.utils.geodata import DATA_DIR
+from app_logic.utils.optimizer import get_existing_stops
+from app_logic.utils.road_network import get_network
+from benchmarks import synthetic
+
+
+def test_bounded_insertion_search_finds_the_full_search_minimum():
+    network = get_network(DATA_DIR)
+    route = get_existing_stops('27', DATA_DIR)
+    lats, lons = [s['lat'] for s in route], [s['lon'] for s in route]
+    plat, plon = synthetic.points_near_line('27', 30, DATA_DIR, seed=7)
+
+    costs = network.insertion_costs(lats, lons, plat, plon)
+
+    stop_nodes, stop_snap = network.snap(lats, lons)
+    next_nodes, next_snap = np.roll(stop_nodes, -1), np.roll(stop_snap, -1)
+    legs = np.array([network.leg(a, b) for a, b in zip(stop_nodes, next_nodes)]) + stop_snap + next_snap
+    for k, (node, snap) in enumerate(zip(*network.snap(plat, plon))):
+        d = network.distances_from(node).astype(float)
+        full = d[stop_nodes] + stop_snap + d[next_nodes] + next_snap + 2 * snap - legs
+        # The cached full searches are float32: agree to the centimetre
+        assert abs(costs[k].min() - full.min()) < 0.01